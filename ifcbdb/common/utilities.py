@@ -87,4 +87,69 @@ def decimate(i, limit=None):
         return i
     c = [0] * chunk_size
     c[-1] = 1
-    return compress(i, cycle(c))
\ No newline at end of file
+    return compress(i, cycle(c))
+
+def bucket_edges(n, n_buckets):
+    """
+    Returns the start indices of n_buckets roughly equal buckets of the points between the first and last of n points,
+      followed by the index of the last point
+    """
+    return numpy.linspace(1, n - 1, n_buckets + 1).astype(numpy.int64)
+
+
+def lttb(x, y, n_out):
+    """
+    Downsamples a series to n_out points using Largest-Triangle-Three-Buckets, which keeps the points that contribute
+      most to the visual shape of the series. The first and last points are always kept. x and y are NumPy arrays with
+      x sorted; returns the indices of the points to keep
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return numpy.arange(n)
+    x = x.astype(numpy.float64)
+    y = y.astype(numpy.float64)
+    edges = bucket_edges(n, n_out - 2)
+    # average point of each bucket, used as the third vertex of the triangles for the bucket before it
+    sums_x = numpy.add.reduceat(x[:n - 1], edges[:-1])
+    sums_y = numpy.add.reduceat(y[:n - 1], edges[:-1])
+    counts = numpy.diff(edges)
+    avg_x = numpy.append(sums_x / counts, x[-1])[1:]
+    avg_y = numpy.append(sums_y / counts, y[-1])[1:]
+    selected = numpy.empty(n_out, dtype=numpy.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # twice the area of the triangle formed by the last selected point, each point in this bucket, and the
+        # average point of the next bucket
+        area = numpy.abs((x[a] - avg_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y[i] - y[a]))
+        a = lo + int(numpy.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def min_max(x, y, n_out):
+    """
+    Downsamples a series to at most n_out points by keeping the minimum and maximum of each of n_out / 2 buckets,
+      in order, which preserves peaks. x and y are NumPy arrays with x sorted; returns the indices of the points to keep
+    """
+    n = len(x)
+    if n_out >= n or n_out < 4:
+        return numpy.arange(n)
+    y = y.astype(numpy.float64)
+    edges = bucket_edges(n, (n_out - 2) // 2)
+    starts, ends = edges[:-1], edges[1:]
+    bucket = numpy.repeat(numpy.arange(len(starts)), ends - starts)
+    inner = y[1:n - 1]
+    # argmin/argmax within each bucket, by sorting on (bucket, value)
+    order = numpy.lexsort((inner, bucket))
+    mins = order[starts - 1] + 1
+    maxs = order[ends - 2] + 1
+    return numpy.unique(numpy.concatenate([[0], mins, maxs, [n - 1]]))
+
+
+DOWNSAMPLE_METHODS = {
+    'lttb': lttb,
+    'minmax': min_max,
+}
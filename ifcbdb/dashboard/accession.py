@@ -1,25 +1,36 @@
 import os
-import json
+import csv
+import logging
 import time
 import re
 
 from collections import defaultdict
-from itertools import islice
+from contextlib import nullcontext
+from functools import partial
+from itertools import chain, islice
 
 from django.db import IntegrityError, transaction
 from django.db.models import Count, Max
+from django.utils import timezone
 from django.contrib.postgres.aggregates.general import StringAgg
 
 import pandas as pd
-import numpy as np
+import billiard
 
-from .models import Bin, DataDirectory, Instrument, Timeline, Dataset, normalize_tag_name, Team, TeamDataset
+from .models import Bin, DataDirectory, Instrument, Timeline, Dataset, normalize_tag_name, Team, TeamDataset, \
+    SyncCheckpoint, FILL_VALUE, Tag, TagEvent, Comment, MosaicLayout
 from .qaqc import check_bad, check_no_rois
+from .roi import count_rois
+from .rollups import update_rollups, update_bin_rollups
+from .datacache import bump_data_version, bump_bin_data_version, cached_response
+from .mosaic import Mosaic, encode_layout
+
+from common.utilities import parse_view_size
 
 import ifcb
-from ifcb.data.files import time_filter
-from ifcb.data.adc import SCHEMA_VERSION_1
-from ifcb.data.stitching import InfilledImages
+from ifcb.data.files import time_filter, Fileset, FilesetBin
+
+logger = logging.getLogger(__name__)
 
 
 def progress(bin_id, added, total, bad, errors={}):
@@ -41,13 +52,30 @@ def do_nothing(*args, **kwargs):
 
 class Accession(object):
     # wraps a dataset object to provide accession
-    def __init__(self, dataset, batch_size=100, lat=None, lon=None, depth=None, newest_only=False):
+    def __init__(self, dataset, batch_size=100, lat=None, lon=None, depth=None, newest_only=False, workers=1,
+                 incremental=False, resume=True, mosaics=False):
         self.dataset = dataset
         self.batch_size = batch_size
         self.lat = lat
         self.lon = lon
         self.depth = depth
         self.newest_only = newest_only
+        # number of worker processes computing qaqc checks and metrics; 1 means do it all in this process
+        self.workers = max(1, workers or 1)
+        # only walk subdirectories that have changed since the last successful sync
+        self.incremental = incremental
+        self.scanned = [] # (DataDirectory, scan) for each directory walked by scan()
+        # pick up an interrupted sync from its checkpoint rather than starting over
+        self.resume = resume
+        self.position = None # (DataDirectory, position, pid) of the last fileset yielded by scan()
+        # pack the mosaic layout for the default view size and scale of each bin as it's added
+        self.mosaics = mosaics
+    def process_pool(self):
+        if self.workers == 1:
+            return nullcontext()
+        # billiard, celery's fork of multiprocessing, can start a pool from a celery worker process, which
+        # multiprocessing refuses to do because celery's worker processes are daemonic
+        return billiard.Pool(self.workers)
     def start_time(self):
         if not self.newest_only or not self.dataset.bins:
             return None
@@ -55,29 +83,101 @@ class Accession(object):
         if b:
             return b.sample_time
         return None
-    def scan(self):
-        for dd in self.dataset.directories.filter(kind=DataDirectory.RAW).order_by('priority'):
-            if not os.path.exists(dd.path):
-                continue # skip and continue searching
-            directory = ifcb.DataDirectory(dd.path)
-            for b in directory:
+    def scan(self, checkpoint=None):
+        dds = [dd for dd in self.dataset.directories.filter(kind=DataDirectory.RAW).order_by('priority', 'id')
+            if os.path.exists(dd.path)] # skip and continue searching
+        # directories before the checkpoint's were finished by the interrupted sync
+        resuming = checkpoint is not None and checkpoint.data_directory_id in [dd.id for dd in dds]
+        for dd in dds:
+            if resuming and dd.id != checkpoint.data_directory_id:
+                continue
+            if self.incremental:
+                directory = dd.get_incremental_scan()
+            else:
+                directory = ifcb.DataDirectory(dd.path)
+            self.scanned.append((dd, directory))
+            skip = checkpoint.position if resuming else 0
+            resuming = False
+            for position, b in enumerate(directory, 1):
+                if position <= skip:
+                    if position == skip and b.lid != checkpoint.last_pid:
+                        # files have been added or removed since; anything missed is found by the next sync
+                        logger.warning('resuming sync of {} at {}, expected {}'.format(dd.path, b.lid, checkpoint.last_pid))
+                    continue
+                self.position = (dd, position, b.lid)
                 yield (b, dd)
-    def sync_one(self, pid):
-        bin = None
-        dd_found = None
+    def stranded(self):
+        # bins created by an interrupted sync that never got their metrics
+        bins = Bin.objects.filter(data_directory__dataset=self.dataset, skip=True,
+            ml_analyzed=FILL_VALUE, metadata={}).select_related('data_directory').order_by('pid')
+        for b in bins.iterator():
+            # constructing a Fileset doesn't touch the files, so check for them here
+            if not b.path or not all(os.path.exists(b.path + ext) for ext in FILESET_EXTENSIONS):
+                # files are gone; leave the bin for an administrator to deal with
+                logger.warning('cannot reprocess {} from {}'.format(b.pid, b.path))
+                continue
+            yield (FilesetBin(Fileset(b.path)), b.data_directory)
+    def get_checkpoint(self):
+        try:
+            checkpoint = self.dataset.sync_checkpoint
+        except SyncCheckpoint.DoesNotExist:
+            return None
+        if not self.resume or self.incremental or checkpoint.incremental:
+            checkpoint.delete()
+            return None
+        return checkpoint
+    def save_checkpoint(self, added, total, bad):
+        # incremental syncs aren't checkpointed: positions in an incremental scan shift when directories change
+        # between runs, and since the manifest is only saved when a scan completes, an interrupted incremental
+        # sync is simply redone by the next one, which skips the bins that were already added
+        if self.incremental:
+            return
+        dd, position, pid = self.position if self.position else (None, 0, '')
+        SyncCheckpoint.objects.update_or_create(dataset=self.dataset, defaults={
+            'data_directory': dd,
+            'position': position,
+            'last_pid': pid,
+            'incremental': self.incremental,
+            'added': added,
+            'total': total,
+            'bad': bad,
+        })
+    def clear_checkpoint(self):
+        SyncCheckpoint.objects.filter(dataset=self.dataset).delete()
+    def scan_complete(self):
+        # record the time of this sync and, for incremental scans, the new manifest
+        now = timezone.now()
+        for dd, directory in self.scanned:
+            dd.last_synced = now
+            update_fields = ['last_synced']
+            if self.incremental and directory.manifest is not None:
+                dd.scan_manifest = directory.manifest
+                update_fields.append('scan_manifest')
+            dd.save(update_fields=update_fields)
+    def resolve(self, pids):
+        # find the filesets for a list of bin ids, opening each raw data directory once and searching
+        # them in priority order. returns (IFCB bin, DataDirectory) pairs and the ids that weren't found
+        remaining = list(dict.fromkeys(pids))
+        bin_dds = []
         for dd in self.dataset.directories.filter(kind=DataDirectory.RAW).order_by('priority'):
+            if not remaining:
+                break
             if not os.path.exists(dd.path):
                 continue # skip and continue searching
             directory = ifcb.DataDirectory(dd.path)
-            try:
-                bin = directory[pid]
-                dd_found = dd
-            except KeyError:
-                continue
-            if bin is not None:
-                break
-        if bin is None:
+            not_found = []
+            for pid in remaining:
+                try:
+                    bin_dds.append((directory[pid], dd))
+                except KeyError:
+                    not_found.append(pid)
+            remaining = not_found
+        return bin_dds, remaining
+    def sync_one(self, pid):
+        bin_dds, _ = self.resolve([pid])
+        if not bin_dds:
             return 'bin {} not found'.format(pid)
+        bin, dd_found = bin_dds[0]
         # create instrument if necessary
         i = bin.pid.instrument
         version = bin.pid.schema_version
@@ -117,21 +217,43 @@ class Accession(object):
                 b2s.skip = False
                 b2s.save()
                 self.dataset.bins.add(b2s)
+                update_rollups([self.dataset.id], [b2s.sample_time])
+                transaction.on_commit(lambda: bump_data_version([self.dataset.name]))
             else:
                 b2s.save()
-    def sync(self, progress_callback=do_nothing, log_callback=do_nothing):
+    def sync(self, progress_callback=do_nothing, log_callback=do_nothing, bin_dds=None):
+        # bin_dds is an optional iterable of (IFCB bin, DataDirectory) to accession instead of scanning
+        with self.process_pool() as pool:
+            return self._sync(pool, progress_callback, log_callback, bin_dds)
+    def _sync(self, pool, progress_callback, log_callback, bin_dds=None):
         progress_callback(print_progress(progress('',0,0,0,{})))
         bins_added = 0
         total_bins = 0
         bad_bins = 0
         most_recent_bin_id = ''
         newest_done = False
-        scanner = self.scan()
+        scanning = bin_dds is None
         start_time = self.start_time()
+        stranded_pids = set()
+        if scanning:
+            checkpoint = self.get_checkpoint()
+            if checkpoint is not None:
+                bins_added, total_bins, bad_bins = checkpoint.added, checkpoint.total, checkpoint.bad
+                log_callback('resuming sync at {}'.format(checkpoint.last_pid or 'start'))
+            stranded = list(self.stranded())
+            stranded_pids = set(bin.lid for bin, _ in stranded)
+            # stranded bins are reprocessed first, so skip them when the scan reaches them
+            scanned = ((bin, dd) for bin, dd in self.scan(checkpoint) if bin.lid not in stranded_pids)
+            scanner = chain(stranded, scanned)
+        else:
+            scanner = iter(bin_dds)
         errors = {}
         while True:
             bin_dds = list(islice(scanner, self.batch_size))
             if not bin_dds:
+                if scanning:
+                    self.scan_complete()
+                    self.clear_checkpoint()
                 break
             total_bins += len(bin_dds)
             # create instrument(s)
@@ -147,59 +269,50 @@ class Accession(object):
                     instruments[i] = instrument
             # create bins
             then = time.time()
-            bins2save = []
-
+            team = self.dataset.team if self.dataset else None
+            new_bin_dds = []
             for bin_dd in bin_dds:
                 bin, dd = bin_dd
-                pid = bin.lid
-                most_recent_bin_id = pid
-                log_callback('{} found'.format(pid))
-                instrument = instruments[bin.pid.instrument]
-                timestamp = bin.timestamp
-                team = self.dataset.team if self.dataset else None
-                if start_time is not None and bin.timestamp <= start_time:
-                    continue
-                b, created = Bin.objects.get_or_create(pid=pid, defaults={
-                    'timestamp': timestamp,
-                    'sample_time': timestamp,
-                    'instrument': instrument,
-                    'path': os.path.splitext(bin.fileset.adc_path)[0], # path without extension
-                    'data_directory': dd,
-                    'skip': True, # in case accession is interrupted
-                    'team': team,
-                })
-
-                # For existing bins, if the team value is not set, and there is one, save that value. This handles pre-existing
-                #   data that was created prior to the teams feature, allowing it to be backfilled when sync'ing
-                if not created and b.team is None and team is not None:
-                    b.team = team
-                    b.save()
-
-                if not created:
+                most_recent_bin_id = bin.lid
+                log_callback('{} found'.format(bin.lid))
+                if start_time is not None and bin.timestamp <= start_time and bin.lid not in stranded_pids:
                     continue
-                b2s, error = self.add_bin(bin, b)
+                new_bin_dds.append(bin_dd)
+            created_bins = self.create_bins(new_bin_dds, instruments, team)
+            # qaqc and metrics, possibly in parallel
+            bins2save = []
+            bad = []
+            layouts = {} # packed mosaic layouts keyed by pid
+            records = self.bin_records([bin for bin, _ in created_bins], pool)
+            for (bin, b), record in zip(created_bins, records):
+                b2s, error = self.apply_record(b, record)
                 if error is not None:
-                    b2s = None
                     errors[b.pid] = error
-                if b2s is not None:
-                    bins2save.append(b2s)
-                elif created: # created, but bad! delete
+                    # created, but bad! delete
                     log_callback('{} deleting bad bin'.format(b.pid))
-                    b.delete()
-                    bad_bins += 1
+                    bad.append(b.id)
                 else:
-                    log_callback('{} not adding bin'.format(b.pid))
+                    bins2save.append(b2s)
+                    if record.get('mosaic_layout') is not None:
+                        layouts[b.pid] = record['mosaic_layout']
+            if bad:
+                Bin.objects.filter(id__in=bad).delete()
+                bad_bins += len(bad)
             with transaction.atomic():
                 for b in bins2save:
                     b.skip = False # unskip because we're ready to save
-                    b.save()
+                Bin.objects.bulk_update(bins2save, BIN_RECORD_FIELDS)
+                for b in bins2save:
                     log_callback('{} saved'.format(b.pid))
                 # add to dataset, unless the bin has no rois
-                for b in bins2save:
-                    if b.qc_no_rois:
-                        continue
-                    self.dataset.bins.add(b)
-                    bins_added += 1
+                to_add = [b for b in bins2save if not b.qc_no_rois]
+                self.add_to_dataset(to_add)
+                self.add_mosaic_layouts([b for b in to_add if b.pid in layouts], layouts)
+                update_rollups([self.dataset.id], [b.sample_time for b in to_add])
+                transaction.on_commit(lambda: bump_data_version([self.dataset.name]))
+                bins_added += len(to_add)
+                if scanning:
+                    self.save_checkpoint(bins_added, total_bins, bad_bins)
             # done with the batch
             status = progress_callback(progress(most_recent_bin_id, bins_added, total_bins, bad_bins, errors))
             if not status: # cancel
@@ -210,82 +323,229 @@ class Accession(object):
         return prog
 
     def add_bin(self, bin, b): # IFCB bin, Bin instance
-        # qaqc checks
-        qc_bad = check_bad(bin)
-        if qc_bad:
-            b.qc_bad = True
-            return b, 'malformed raw data'
-        no_rois = check_no_rois(bin)
-        if no_rois:
-            b.qc_bad = True
-            return b, 'zero ROIs'
-        # more error checking for setting attributes
-        try:
-            ml_analyzed = bin.ml_analyzed
-            if ml_analyzed <= 0:
-                b.qc_bad = True
-                return b, 'ml_analyzed <= 0'
-        except Exception as e:
+        return self.apply_record(b, bin_record(bin))
+
+    def apply_record(self, b, record): # Bin instance, record produced by bin_record
+        error = record['error']
+        if record['qc_bad']:
             b.qc_bad = True
-            return b, 'ml_analyzed: {}'.format(str(e))
+            return b, error
         # paths
         if b.path is None:
-            b.path, _ = os.path.splitext(bin.fileset.adc_path)
+            b.path = record['path']
         # metadata
-        try:
-            headers = bin.hdr_attributes
-        except Exception as e:
-            b.qc_bad = True
-            return b, 'header: {}'.format(str(e))
-        b.metadata_json = json.dumps(headers)
-        #
-        # lat/lon/depth
-        latitude = headers.get('latitude') or headers.get('gpsLatitude')
-        longitude = headers.get('longitude') or headers.get('gpsLongitude')
-
-        depth = headers.get('depth')
-        if latitude is not None and longitude is not None:
-            try:
-                latitude = float(latitude)
-                longitude = float(longitude)
-            except (TypeError, ValueError):
-                latitude = None
-                longitude = None
-            try:
-                depth = float(depth)
-            except TypeError:
-                depth = None
-            if latitude is not None and longitude is not None:
-                b.set_location(longitude, latitude, depth)
-        #
-        sample_type = headers.get('sampleType')
-        if sample_type is not None:
-            b.sample_type = sample_type
-    
-        b.qc_no_rois = check_no_rois(bin)
+        b.metadata = record['metadata']
+        if record['longitude'] is not None and record['latitude'] is not None:
+            b.set_location(record['longitude'], record['latitude'], record['depth'])
+        if record['sample_type'] is not None:
+            b.sample_type = record['sample_type']
+        b.qc_no_rois = record['qc_no_rois']
         # metrics
+        for field in BIN_RECORD_METRICS:
+            setattr(b, field, record[field])
+        return b, error # defer save
+
+    def bin_records(self, bins, pool=None):
+        # compute records for a list of IFCB bins, in the same order, using the process pool if there is one
+        if pool is None:
+            return [bin_record(bin, self.mosaics) for bin in bins]
+        paths = [fileset_path(bin) for bin in bins]
+        chunksize = max(1, len(paths) // (self.workers * 4))
+        return list(pool.map(partial(fileset_record, mosaic=self.mosaics), paths, chunksize=chunksize))
+
+    def create_bins(self, bin_dds, instruments, team):
+        # create Bin instances for any scanned filesets that are not already in the database, and
+        # return (IFCB bin, Bin instance) pairs for the ones that were created, along with any that
+        # were stranded by an interrupted sync
+        pids = [bin.lid for bin, _ in bin_dds]
+        existing = dict(Bin.objects.filter(pid__in=pids).values_list('pid', 'team_id'))
+        stranded = {b.pid: b for b in Bin.objects.filter(pid__in=pids, skip=True,
+            ml_analyzed=FILL_VALUE, metadata={})}
+        # For existing bins, if the team value is not set, and there is one, save that value. This handles pre-existing
+        #   data that was created prior to the teams feature, allowing it to be backfilled when sync'ing
+        if team is not None:
+            no_team = [pid for pid, team_id in existing.items() if team_id is None]
+            if no_team:
+                Bin.objects.filter(pid__in=no_team).update(team=team)
+        new_bins = []
+        stranded_bins = []
+        seen = set()
+        for bin, dd in bin_dds:
+            pid = bin.lid
+            if pid in seen: # found twice in this batch
+                continue
+            seen.add(pid)
+            if pid in stranded:
+                stranded_bins.append((bin, stranded[pid]))
+                continue
+            if pid in existing:
+                continue
+            b = Bin(pid=pid,
+                timestamp=bin.timestamp,
+                sample_time=bin.timestamp,
+                instrument=instruments[bin.pid.instrument],
+                path=fileset_path(bin),
+                data_directory=dd,
+                skip=True, # in case accession is interrupted
+                team=team)
+            new_bins.append((bin, b))
+        if not new_bins:
+            return stranded_bins
+        try:
+            with transaction.atomic():
+                Bin.objects.bulk_create([b for _, b in new_bins])
+        except IntegrityError:
+            # some other process has created some of these bins since we looked, so fall back to
+            # creating them one at a time
+            created_bins = []
+            for bin, b in new_bins:
+                b, created = Bin.objects.get_or_create(pid=b.pid, defaults={
+                    'timestamp': b.timestamp,
+                    'sample_time': b.sample_time,
+                    'instrument': b.instrument,
+                    'path': b.path,
+                    'data_directory': b.data_directory,
+                    'skip': True,
+                    'team': team,
+                })
+                if created:
+                    created_bins.append((bin, b))
+            return stranded_bins + created_bins
+        return stranded_bins + new_bins
+
+    def add_to_dataset(self, bins):
+        # link bins to the dataset in a single statement, ignoring links that already exist
+        through = Bin.datasets.through
+        through.objects.bulk_create([
+            through(bin_id=b.id, dataset_id=self.dataset.id) for b in bins
+        ], ignore_conflicts=True)
+
+    def add_mosaic_layouts(self, bins, layouts):
+        # store the mosaic layouts packed by bin_record, keyed by pid, ignoring any that already exist
+        MosaicLayout.objects.bulk_create([
+            MosaicLayout(**MosaicLayout.key(b, MOSAIC_LAYOUT_SHAPE, MOSAIC_LAYOUT_SCALE), coordinates=layouts[b.pid])
+            for b in bins
+        ], ignore_conflicts=True)
+
+# mosaic layout packed during accession, at the dashboard's default view size and scale
+MOSAIC_LAYOUT_SHAPE = parse_view_size(Bin.MOSAIC_DEFAULT_VIEW_SIZE)
+MOSAIC_LAYOUT_SCALE = Bin.MOSAIC_DEFAULT_SCALE_FACTOR / 100
+
+# metric fields copied from a bin record onto the Bin instance
+BIN_RECORD_METRICS = ['temperature', 'humidity', 'size', 'ml_analyzed', 'look_time', 'run_time',
+    'n_triggers', 'n_images', 'concentration']
+
+# fields written when a batch of accessioned bins is saved
+BIN_RECORD_FIELDS = ['skip', 'qc_bad', 'qc_no_rois', 'path', 'metadata', 'location', 'depth',
+    'sample_type'] + BIN_RECORD_METRICS
+
+# files that make up a fileset
+FILESET_EXTENSIONS = ['.hdr', '.adc', '.roi']
+
+def fileset_path(bin):
+    # path of the fileset without extension
+    return os.path.splitext(bin.fileset.adc_path)[0]
+
+def fileset_record(path, mosaic=False):
+    # entry point for worker processes, which are handed the fileset path rather than the bin
+    return bin_record(FilesetBin(Fileset(path)), mosaic)
+
+def bin_record(bin, mosaic=False):
+    # run the qaqc checks and compute the metrics for an IFCB bin. this does not touch the database
+    # and the result is a plain dict, so it can be computed in a worker process. if mosaic is true,
+    # the bin's default mosaic layout is packed too
+    try:
+        return _bin_record(bin, mosaic)
+    except OSError as e: # files missing or unreadable; report it rather than stopping the sync
+        return {
+            'error': 'cannot read raw data: {}'.format(str(e)),
+            'qc_bad': True,
+        }
+
+def _bin_record(bin, mosaic=False):
+    record = {
+        'error': None,
+        'qc_bad': False,
+    }
+    def bad(error):
+        record['qc_bad'] = True
+        record['error'] = error
+        return record
+    # qaqc checks
+    qc_bad = check_bad(bin)
+    if qc_bad:
+        return bad('malformed raw data')
+    no_rois = check_no_rois(bin)
+    if no_rois:
+        return bad('zero ROIs')
+    # more error checking for setting attributes
+    try:
+        ml_analyzed = bin.ml_analyzed
+        if ml_analyzed <= 0:
+            return bad('ml_analyzed <= 0')
+    except Exception as e:
+        return bad('ml_analyzed: {}'.format(str(e)))
+    # paths
+    record['path'] = fileset_path(bin)
+    # metadata
+    try:
+        headers = bin.hdr_attributes
+    except Exception as e:
+        return bad('header: {}'.format(str(e)))
+    record['metadata'] = headers
+    #
+    # lat/lon/depth
+    latitude = headers.get('latitude') or headers.get('gpsLatitude')
+    longitude = headers.get('longitude') or headers.get('gpsLongitude')
+
+    depth = headers.get('depth')
+    record['latitude'] = None
+    record['longitude'] = None
+    record['depth'] = None
+    if latitude is not None and longitude is not None:
         try:
-            b.temperature = bin.temperature
-        except KeyError: # older data
-            b.temperature = 0
+            latitude = float(latitude)
+            longitude = float(longitude)
+        except (TypeError, ValueError):
+            latitude = None
+            longitude = None
         try:
-            b.humidity = bin.humidity
-        except KeyError: # older data
-            b.humidity = 0
-        b.size = bin.fileset.getsize() # assumes FilesetBin
-        b.ml_analyzed = ml_analyzed
-        b.look_time = bin.look_time
-        b.run_time = bin.run_time
-        b.n_triggers = bin.n_triggers
-        if bin.pid.schema_version == SCHEMA_VERSION_1:
-            ii = InfilledImages(bin)
-            b.n_images = len(ii)
-        else:
-            b.n_images = len(bin.images)
-        b.concentration = b.n_images / ml_analyzed
-        if b.concentration < 0: # metadata is bogus!
-            return b, 'rois/ml is < 0'
-        return b, None # defer save
+            depth = float(depth)
+        except TypeError:
+            depth = None
+        if latitude is not None and longitude is not None:
+            record['latitude'] = latitude
+            record['longitude'] = longitude
+            record['depth'] = depth
+    #
+    record['sample_type'] = headers.get('sampleType')
+
+    record['qc_no_rois'] = check_no_rois(bin)
+    # metrics
+    try:
+        record['temperature'] = bin.temperature
+    except KeyError: # older data
+        record['temperature'] = 0
+    try:
+        record['humidity'] = bin.humidity
+    except KeyError: # older data
+        record['humidity'] = 0
+    record['size'] = bin.fileset.getsize() # assumes FilesetBin
+    record['ml_analyzed'] = ml_analyzed
+    record['look_time'] = bin.look_time
+    record['run_time'] = bin.run_time
+    record['n_triggers'] = bin.n_triggers
+    record['n_images'] = count_rois(bin)
+    record['concentration'] = record['n_images'] / ml_analyzed
+    if record['concentration'] < 0: # metadata is bogus!
+        record['error'] = 'rois/ml is < 0'
+    if mosaic and not record['qc_no_rois']:
+        try:
+            m = Mosaic(bin, shape=MOSAIC_LAYOUT_SHAPE, scale=MOSAIC_LAYOUT_SCALE)
+            record['mosaic_layout'] = encode_layout(m.pack())
+        except Exception as e: # the layout will be packed when the mosaic is first viewed
+            logger.warning('{} mosaic layout: {}'.format(record['path'], str(e)))
+    return record
 
 def import_progress(bin_id, n_modded, errors, done=False):
     #print(bin_id, n_modded, errors, error_message, done) # FIXME debug
@@ -296,8 +556,14 @@ def import_progress(bin_id, n_modded, errors, done=False):
         'done': done,
     }
 
-def import_metadata(metadata_dataframe, progress_callback=do_nothing):
-    df = metadata_dataframe.copy()
+def import_metadata(metadata, progress_callback=do_nothing, team_ids=None):
+    # metadata is a dataframe, or an iterable of dataframes (e.g., from read_csv with a chunksize) so that
+    # large files don't have to be read all at once. if team_ids is given, only bins belonging to those
+    # teams are modified, and rows for other bins are ignored
+    if isinstance(metadata, pd.DataFrame):
+        metadata = [metadata]
+    chunks = iter(metadata)
+    df = next(chunks, pd.DataFrame()).copy()
 
     BIN_ID_COLUMNS = ['id','pid','lid','bin','bin_id','sample','sample_id','filename']
     LAT_COLUMNS = ['latitude','lat','y','gpsLatitude']
@@ -366,238 +632,369 @@ def import_metadata(metadata_dataframe, progress_callback=do_nothing):
         if c.startswith('tag'):
             tag_cols.append(c)
 
+    # validate and convert numeric and time columns a batch at a time. cells that have a value that
+    # can't be converted are reported as errors on their rows
+    def coerce(batch, col, convert):
+        if col is None:
+            return None, None
+        values = convert(batch[col])
+        return values.to_numpy(), (values.isnull() & batch[col].notnull()).to_numpy()
+
+    to_number = lambda c: pd.to_numeric(c, errors='coerce')
+    to_time = lambda c: pd.to_datetime(c, utc=True, errors='coerce', format='mixed')
+
+    def check(batch, col, bad, i):
+        if bad is not None and bad[i]:
+            raise ValueError('{} value "{}" is not valid'.format(col, batch[col].iat[i]))
+
+    def present(values, i):
+        return values is not None and not pd.isnull(values[i])
+
+    # the fields that can be changed by this import
+    fields = []
+    if ts_col is not None:
+        fields.append('sample_time')
+    if lat_col is not None and lon_col is not None:
+        fields.append('location')
+    if depth_col is not None:
+        fields.append('depth')
+    if sample_type_col is not None:
+        fields.append('sample_type')
+    if cruise_col is not None:
+        fields.append('cruise')
+    if cast_col is not None:
+        fields.append('cast')
+    if niskin_col is not None:
+        fields.append('niskin')
+    if ma_col is not None:
+        fields.extend(['ml_analyzed', 'concentration'])
+    if skip_col is not None:
+        fields.append('skip')
+
+    # fields that affect timeline rollups
+    ROLLUP_FIELDS = set(['sample_time', 'skip', 'ml_analyzed', 'concentration'])
+
     n_modded = 0
-    progress_batch_size = 50
+    batch_size = 1000
 
-    b = None
+    last_pid = ''
     errors = []
 
     should_continue = True
 
-    for row in df.itertuples():
+    def batches():
+        for chunk in chain([df], chunks):
+            chunk.columns = [s.lower().strip() for s in chunk.columns]
+            for batch_start in range(0, len(chunk), batch_size):
+                yield chunk.iloc[batch_start:batch_start + batch_size]
+
+    for batch in batches():
         if not should_continue:
             break
 
-        try:
-            pid = get_cell(row, pid_col)
-            if pid is None:
-                raise ValueError('bin id must be specified')
-
+        timestamps, bad_timestamps = coerce(batch, ts_col, to_time)
+        lats, bad_lats = coerce(batch, lat_col, to_number)
+        lons, bad_lons = coerce(batch, lon_col, to_number)
+        depths, bad_depths = coerce(batch, depth_col, to_number)
+        niskins, bad_niskins = coerce(batch, niskin_col, to_number)
+        mls, bad_mls = coerce(batch, ma_col, to_number)
+
+        # resolve all the bins in this batch with one query
+        pids = [str(pid) for pid in batch[pid_col].dropna()]
+        bqs = Bin.objects.defer('metadata')
+        if team_ids is not None:
+            bqs = bqs.filter(team_id__in=team_ids)
+        bins = bqs.in_bulk(pids, field_name='pid')
+        # sample times before this batch, since rollups for both old and new times may change
+        old_times = {b.id: b.sample_time for b in bins.values()}
+
+        modified = {} # by bin id
+        bin_tags = [] # (bin id, tag name)
+        bin_comments = [] # (bin id, comment)
+
+        for i, row in enumerate(batch.itertuples()):
             try:
-                b = Bin.objects.get(pid=pid)
-            except Bin.DoesNotExist:
-                raise KeyError('Bin {} not found'.format(pid))
-
-            # spatiotemporal metadata
-
-            if ts_col is not None:
-                ts_str = get_cell(row, ts_col)
-                if ts_str is not None:
-                    ts = pd.to_datetime(ts_str, utc=True)
-                    if not pd.isnull(ts):
-                        b.sample_time = ts
-           
-            if lat_col is not None and lon_col is not None:
-                lat = get_cell(row, lat_col)
-                lon = get_cell(row, lon_col)
-                if lat is not None and lon is not None:
-                    b.set_location(lon, lat)
-
-            if depth_col is not None:
-                depth = get_cell(row, depth_col)
-                if depth is not None:
-                    b.depth = depth
-
-            # sample type
-
-            if sample_type_col is not None:
-                sample_type = get_cell(row, sample_type_col)
-                if sample_type is not None:
-                    b.sample_type = sample_type
-
-            # cruise / cast / niskin
-
-            if cruise_col is not None:
-                cruise = get_cell(row, cruise_col)
-                if cruise is not None:
-                    b.cruise = str(cruise)
-
-            if cast_col is not None:
-                cast = get_cell(row, cast_col)
-                if cast is not None:
-                    try:
-                        cast_number = int(cast)
-                        b.cast = str(cast_number)
-                    except ValueError:
-                        b.cast = str(cast)
-
-            if niskin_col is not None:
-                niskin = get_cell(row, niskin_col)
-                if niskin is not None:
-                    b.niskin = int(niskin)
-
-            # ml_analyzed
-
-            if ma_col is not None:
-                ml_analyzed = get_cell(row, ma_col)
+                pid = get_cell(row, pid_col)
+                if pid is None:
+                    raise ValueError('bin id must be specified')
+
+                b = bins.get(str(pid))
+                if b is None and team_ids is not None:
+                    continue # not one of the bins that can be modified
+                if b is None:
+                    raise KeyError('Bin {} not found'.format(pid))
+
+                # validate the whole row before changing the bin
+                updates = {}
+                location = None
+                ml_analyzed = None
+                tags = []
+                comment = None
+
+                # spatiotemporal metadata
+
+                check(batch, ts_col, bad_timestamps, i)
+                if present(timestamps, i):
+                    updates['sample_time'] = timestamps[i]
+
+                check(batch, lat_col, bad_lats, i)
+                check(batch, lon_col, bad_lons, i)
+                if present(lats, i) and present(lons, i):
+                    location = (float(lons[i]), float(lats[i]))
+
+                check(batch, depth_col, bad_depths, i)
+                if present(depths, i):
+                    updates['depth'] = float(depths[i])
+
+                # sample type
+
+                if sample_type_col is not None:
+                    sample_type = get_cell(row, sample_type_col)
+                    if sample_type is not None:
+                        updates['sample_type'] = sample_type
+
+                # cruise / cast / niskin
+
+                if cruise_col is not None:
+                    cruise = get_cell(row, cruise_col)
+                    if cruise is not None:
+                        updates['cruise'] = str(cruise)
+
+                if cast_col is not None:
+                    cast = get_cell(row, cast_col)
+                    if cast is not None:
+                        try:
+                            cast_number = int(cast)
+                            updates['cast'] = str(cast_number)
+                        except ValueError:
+                            updates['cast'] = str(cast)
+
+                check(batch, niskin_col, bad_niskins, i)
+                if present(niskins, i):
+                    updates['niskin'] = int(niskins[i])
+
+                # ml_analyzed
+
+                check(batch, ma_col, bad_mls, i)
+                if present(mls, i):
+                    ml_analyzed = float(mls[i])
+                    if ml_analyzed == 0:
+                        raise ValueError('ml_analyzed must not be zero')
+
+                # tags and comments
+
+                if tag_cols:
+                    for c in tag_cols:
+                        cell = get_cell(row, c)
+                        if cell is None:
+                            continue
+
+                        tag = str(get_cell(row, c)).strip()
+                        if tag == '':
+                            continue
+
+                        normalized = normalize_tag_name(tag)
+                        if not tag or not normalized:
+                            raise ValueError('blank tag name "{}"'.format(tag))
+                        if re.match(r'^[0-9]+$',normalized):
+                            raise ValueError('tag "{}" consists of digits'.format(tag))
+                        tags.append(normalized)
+
+                if comments_col is not None:
+                    body = get_cell(row, comments_col)
+                    if body is not None:
+                        comment = str(body)
+
+                # skip flag
+
+                if skip_col is not None:
+                    skip = get_cell(row, skip_col)
+                    if skip is None:
+                        pass
+                    elif type(skip) is bool:
+                        updates['skip'] = skip
+                    elif type(skip) is int and skip in [0,1]:
+                        updates['skip'] = bool(skip)
+                    elif type(skip) is str:
+                        if skip.lower() in SKIP_POSITIVE_VALUES:
+                            updates['skip'] = True
+                        elif skip.lower() in SKIP_NEGATIVE_VALUES:
+                            updates['skip'] = False
+                    else:
+                        raise ValueError(
+                            'skip value "{}" had unsupported type "{}"'.format(skip, type(skip).__name__))
+
+                # now apply the row
+                for field, value in updates.items():
+                    setattr(b, field, value)
+                if location is not None:
+                    b.set_location(*location)
                 if ml_analyzed is not None:
                     b.set_ml_analyzed(ml_analyzed)
+                modified[b.id] = b
+                bin_tags.extend((b.id, tag) for tag in tags)
+                if comment is not None:
+                    bin_comments.append((b.id, comment))
+
+                n_modded += 1
+                last_pid = b.pid
+
+            except Exception as e:
+                errors.append({
+                    'row': row.Index + 2, # why 2 and not 1?
+                    'message': str(e),
+                    })
 
-            # tags and comments
-
-            if tag_cols:
-                for c in tag_cols:
-                    cell = get_cell(row, c)
-                    if cell is None:
-                        continue
-
-                    tag = str(get_cell(row, c)).strip()
-                    if tag == '':
-                        continue
-
-                    normalized = normalize_tag_name(tag)
-                    if not tag or not normalized:
-                        raise ValueError('blank tag name "{}"'.format(tag))
-                    if re.match(r'^[0-9]+$',normalized):
-                        raise ValueError('tag "{}" consists of digits'.format(tag))
-                    b.add_tag(normalized)
-
-            if comments_col is not None:
-                body = get_cell(row, comments_col)
-                if body is not None:
-                    b.add_comment(body, skip_duplicates=True)
-
-            # skip flag
-
-            if skip_col is not None:
-                skip = get_cell(row, skip_col)
-                if skip is None:
-                    pass
-                elif type(skip) is bool:
-                    b.skip = skip
-                elif type(skip) is int and skip in [0,1]:
-                    b.skip = bool(skip)
-                elif type(skip) is str:
-                    if skip.lower() in SKIP_POSITIVE_VALUES:
-                        b.skip = True
-                    elif skip.lower() in SKIP_NEGATIVE_VALUES:
-                        b.skip = False
-                else:
-                    raise ValueError(
-                        'skip value "{}" had unsupported type "{}"'.format(skip, type(skip).__name__))
+        with transaction.atomic():
+            if modified and fields:
+                Bin.objects.bulk_update(modified.values(), fields, batch_size=batch_size)
+                if set(fields) & ROLLUP_FIELDS:
+                    times = [old_times[id] for id in modified] + [b.sample_time for b in modified.values()]
+                    update_bin_rollups(modified.keys(), times)
+            bulk_add_tags(bin_tags)
+            bulk_add_comments(bin_comments)
+            changed = set(modified) | set(id for id, _ in bin_tags) | set(id for id, _ in bin_comments)
+            if changed:
+                transaction.on_commit(lambda changed=changed: bump_bin_data_version(changed))
 
-            n_modded += 1
-            b.save()
-            
-            if n_modded % progress_batch_size == 0:
-                should_continue = progress_callback(import_progress(b.pid, n_modded, errors))
-
-        except Exception as e:
-            errors.append({
-                'row': row.Index + 2, # why 2 and not 1?
-                'message': str(e),
-                })
+        should_continue = progress_callback(import_progress(last_pid, n_modded, errors))
 
-    if b is not None:
-        progress = import_progress(b.pid, n_modded, errors, True)
-    else:
-        progress = import_progress('', n_modded, errors, True)
+    progress = import_progress(last_pid, n_modded, errors, True)
 
     progress_callback(progress)
 
     return progress
 
-def export_metadata(ds, bins):
-    # Maximum number of bins this export can return. The limit is relatively arbitrary, and in place to prevent runaway
-    #   queries returning lots of data when no search parameters are defined
-    max_results = 500_000
-
+def bulk_add_tags(bin_tags):
+    # tag bins given (bin id, normalized tag name) pairs, skipping tags the bins already have
+    if not bin_tags:
+        return
+    names = set(name for _, name in bin_tags)
+    tag_ids = {}
+    for tag_id, name in Tag.objects.filter(name__in=names).order_by('id').values_list('id', 'name'):
+        tag_ids.setdefault(name, tag_id)
+    missing = [Tag(name=name) for name in names if name not in tag_ids]
+    for tag in Tag.objects.bulk_create(missing):
+        tag_ids[tag.name] = tag.id
+    pairs = set((bin_id, tag_ids[name]) for bin_id, name in bin_tags)
+    existing = set(TagEvent.objects.filter(bin_id__in=set(b for b, _ in pairs), tag_id__in=set(t for _, t in pairs)) \
+        .values_list('bin_id', 'tag_id'))
+    TagEvent.objects.bulk_create([TagEvent(bin_id=bin_id, tag_id=tag_id)
+        for bin_id, tag_id in sorted(pairs - existing)])
+
+def bulk_add_comments(bin_comments):
+    # add comments given (bin id, content) pairs, skipping duplicates of existing comments
+    if not bin_comments:
+        return
+    existing = set(Comment.objects.filter(bin_id__in=set(b for b, _ in bin_comments), user=None,
+        content__in=set(c for _, c in bin_comments)).values_list('bin_id', 'content'))
+    new_comments = []
+    for bin_id, content in bin_comments:
+        if (bin_id, content) in existing:
+            continue
+        existing.add((bin_id, content))
+        new_comments.append(Comment(bin_id=bin_id, content=content))
+    Comment.objects.bulk_create(new_comments)
+
+# number of bins fetched from the database at a time when exporting metadata
+EXPORT_CHUNK_SIZE = 2000
+
+def max_tags_per_bin():
+    # the most tags on any one bin. this depends only on the number of tag events, and is cached until
+    # any bin's tags change
+    def compute():
+        return TagEvent.objects.values('bin_id').annotate(n_tags=Count('tag', distinct=True)).order_by() \
+            .aggregate(max=Max('n_tags'))['max'] or 0
+    return cached_response('max_tags_per_bin', {}, compute)
+
+def export_metadata(ds, bins, chunk_size=EXPORT_CHUNK_SIZE):
+    # generate the rows of a metadata export, starting with the header. bins are read with a
+    # server-side cursor and tags, comments and trigger selection are fetched for each chunk of bins,
+    # so memory use doesn't depend on the number of bins
     name = ds.name if ds else ''
     dataset_location = ds.location if ds else None
     dataset_depth = ds.depth if ds else None
     bqs = bins
 
-    qs = bqs.values('id','pid','sample_time','location','ml_analyzed',
-        'cruise','cast','niskin','depth', 'instrument__number', 'skip',
-        'sample_type', 'n_images', 'tags__name').order_by('pid','tags__name')
-
-    # fetch all tags and compute number of tag columns
-    tags_by_id = defaultdict(list)
-    n_tag_cols = 0
-    for item in qs:
-        tag_name = item['tags__name']
-        if tag_name:
-            id = item['id']
-            tags = tags_by_id[id]
-            tags.append(tag_name)
-            if len(tags) > n_tag_cols:
-                n_tag_cols = len(tags)
-    # fetch all comment summaries
-    comment_summary_by_id = \
-        dict(bqs.filter(comments__isnull=False).values_list('id') \
-             .annotate(comment_summary=StringAgg('comments__content', delimiter='; ', ordering='comments__timestamp')))
-    # fetch selected metadata fields
-    # PMTtriggerSelection_DAQ_MCConly
-    trigger_selection_key = 'PMTtriggerSelection_DAQ_MCConly'
-    id2md = bqs.filter(metadata_json__contains=trigger_selection_key).values_list('id', 'metadata_json')
-    trigger_selection_by_id = dict([(id, json.loads(md).get(trigger_selection_key)) for id, md in id2md])
-    # now construct the dataframe
-    r = defaultdict(list)
+    # the number of tag columns is the most tags on any one bin in the database, rather than in this export,
+    # so that the header doesn't depend on reading every bin first
+    n_tag_cols = max_tags_per_bin()
 
+    header = ['pid', 'sample_time', 'ifcb', 'ml_analyzed', 'latitude', 'longitude', 'depth',
+        'cruise', 'cast', 'niskin', 'sample_type', 'n_images']
+    header += ['tag{}'.format(i+1) for i in range(n_tag_cols)]
+    header += ['comment_summary', 'trigger_selection', 'skip']
     # Only add the name column if dataset criteria was provided
     if name:
-        r.update({'dataset': name})
+        header.insert(0, 'dataset')
+    yield header
 
-    # fast way to remove duplicates
-    prev_pid = None
-
-    # The "all()" is required to make sure there's a LIMIT statement added the query, rather than pulling back all
-    #   records and then taking part of the list
-    qs = qs.all()[:max_results]
+    qs = bqs.values('id','pid','sample_time','location','ml_analyzed',
+        'cruise','cast','niskin','depth', 'instrument__number', 'skip',
+        'sample_type', 'n_images').order_by('pid')
 
-    for item in qs:
-        if item['pid'] == prev_pid:
-            continue
-        prev_pid = item['pid']
+    # fast way to remove duplicates caused by joins in the query
+    def unique_items():
+        prev_pid = None
+        for item in qs.iterator(chunk_size=chunk_size):
+            if item['pid'] == prev_pid:
+                continue
+            prev_pid = item['pid']
+            yield item
 
-        def add(field, rename=None):
-            if rename is not None:
-                r[rename].append(item[field])
+    items = unique_items()
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            break
+        ids = [item['id'] for item in chunk]
+        # fetch tags for this chunk
+        tags_by_id = defaultdict(list)
+        for id, tag_name in TagEvent.objects.filter(bin_id__in=ids) \
+                .values_list('bin_id', 'tag__name').order_by('bin_id', 'tag__name').distinct():
+            tags_by_id[id].append(tag_name)
+        # fetch comment summaries
+        comment_summary_by_id = dict(Comment.objects.filter(bin_id__in=ids).values_list('bin_id') \
+             .annotate(comment_summary=StringAgg('content', delimiter='; ', ordering='timestamp')).order_by())
+        # fetch selected metadata fields
+        # PMTtriggerSelection_DAQ_MCConly
+        trigger_selection_key = 'PMTtriggerSelection_DAQ_MCConly'
+        trigger_selection_by_id = dict(Bin.objects.filter(id__in=ids, metadata__has_key=trigger_selection_key) \
+            .values_list('id', 'metadata__{}'.format(trigger_selection_key)))
+
+        for item in chunk:
+            row = [name] if name else []
+            row += [item['pid'], item['sample_time'], item['instrument__number'], item['ml_analyzed']]
+            if item['location'] is not None:
+                row += [item['location'].y, item['location'].x]
+            elif dataset_location is not None:
+                row += [dataset_location.y, dataset_location.x]
             else:
-                r[field].append(item[field])
-
-        add('pid')
-        add('sample_time')
-        add('instrument__number', rename='ifcb')
-        add('ml_analyzed')
-        if item['location'] is not None:
-            r['latitude'].append(item['location'].y)
-            r['longitude'].append(item['location'].x)
-        elif dataset_location is not None:
-            r['latitude'].append(dataset_location.y)
-            r['longitude'].append(dataset_location.x)
-        else:
-            r['latitude'].append(np.nan)
-            r['longitude'].append(np.nan)
-        if item['depth'] is not None:
-            add('depth')
-        elif dataset_depth is not None:
-            r['depth'].append(dataset_depth)
-        else:
-            r['depth'].append(np.nan)
-        add('cruise')
-        add('cast')
-        add('niskin')
-        add('sample_type')
-        add('n_images')
-        tag_names = tags_by_id[item['id']]
-        for i in range(n_tag_cols):
-            v = tag_names[i] if i < len(tag_names) else ''
-            r[f'tag{i+1}'].append(v)
-        r['comment_summary'].append(comment_summary_by_id.get(item['id'], ''))
-        r['trigger_selection'].append(trigger_selection_by_id.get(item['id'], ''))
-        r['skip'].append(1 if item['skip'] else 0)
-
-    df = pd.DataFrame(r)
-
-    return df
\ No newline at end of file
+                row += [None, None]
+            if item['depth'] is not None:
+                row.append(item['depth'])
+            else:
+                row.append(dataset_depth)
+            row += [item['cruise'], item['cast'], item['niskin'], item['sample_type'], item['n_images']]
+            tag_names = tags_by_id[item['id']]
+            for i in range(n_tag_cols):
+                row.append(tag_names[i] if i < len(tag_names) else '')
+            row.append(comment_summary_by_id.get(item['id'], ''))
+            row.append(trigger_selection_by_id.get(item['id'], ''))
+            row.append(1 if item['skip'] else 0)
+            yield row
+
+class Echo(object):
+    # file-like object that returns what is written to it, so csv.writer can format one row at a time
+    def write(self, value):
+        return value
+
+def export_metadata_csv(ds, bins):
+    # generate a metadata export as CSV text, a chunk of rows at a time
+    writer = csv.writer(Echo())
+    rows = export_metadata(ds, bins)
+    while True:
+        chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            break
+        yield ''.join(writer.writerow(row) for row in chunk)
@@ -0,0 +1,67 @@
+import json
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from .models import Dataset
+
+# caching of responses derived from bin data. each dataset has a data version that is bumped whenever its bins
+# change, and cache keys include it, so cached responses never expire but are never stale either. responses for
+# queries that aren't limited to a dataset use a global version that is bumped along with every dataset's.
+# changes to datasets themselves or to tag names bump a catalog version, which invalidates every cached response
+
+# cached responses expire after this many seconds even if no version is bumped, in case data is changed
+# in a way that doesn't bump one, such as directly in the database
+RESPONSE_TIMEOUT = 24 * 60 * 60
+
+# these can't be dataset names
+GLOBAL_VERSION = '/all'
+CATALOG_VERSION = '/catalog'
+
+def hashed(value):
+    # memcached keys can't have spaces and are limited in length
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode('utf8')).hexdigest()
+
+def data_version_key(dataset_name):
+    return 'data_version_{}'.format(hashed(dataset_name))
+
+def data_version(dataset_name=None):
+    key = data_version_key(dataset_name or GLOBAL_VERSION)
+    version = cache.get(key)
+    if version is None:
+        # start from the time, so that a version that is evicted from the cache isn't reused
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+def bump_data_version(dataset_names=()):
+    # invalidate cached responses for the datasets, and for queries across datasets
+    for name in set(dataset_names) | set([GLOBAL_VERSION]):
+        key = data_version_key(name)
+        try:
+            cache.incr(key)
+        except ValueError: # not in the cache
+            cache.add(key, int(time.time() * 1000), timeout=None)
+
+def bump_catalog_version():
+    bump_data_version([CATALOG_VERSION])
+
+def bump_bin_data_version(bin_ids):
+    # invalidate cached responses for every dataset the bins are in
+    names = Dataset.objects.filter(bins__id__in=list(bin_ids)).values_list('name', flat=True).distinct()
+    bump_data_version(names)
+
+def cached_response(name, params, compute):
+    # returns the result of compute() for a kind of response and its normalized query parameters, from the
+    # cache if it's there. params should include 'dataset' if the query is limited to a dataset
+    version = [data_version(params.get('dataset')), data_version(CATALOG_VERSION)]
+    key = 'response_{}_{}'.format(name, hashed([params, version]))
+    result = cache.get(key)
+    if result is None:
+        result = compute()
+        try:
+            cache.set(key, result, timeout=RESPONSE_TIMEOUT)
+        except Exception: # value is probably too large
+            pass
+    return result
@@ -0,0 +1,211 @@
+import os
+import time
+import shutil
+import tempfile
+import hashlib
+import json
+
+from itertools import islice
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ifcb.data.adc import schema_names
+
+from .models import Bin, Dataset, bin_query
+from .accession import export_metadata, EXPORT_CHUNK_SIZE
+from .datacache import data_version, CATALOG_VERSION
+
+# columnar exports of bin metadata and per-ROI data, written in the background and cached on disk
+
+EXPORT_KINDS = ['bins', 'rois']
+
+# format name -> (file extension, content type)
+EXPORT_FORMATS = {
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('.arrow', 'application/vnd.apache.arrow.file'),
+}
+
+# number of bins whose ROI data are gathered before being written out
+ROI_BATCH_SIZE = 100
+
+# column types of the bin table. tag columns are strings
+BIN_TABLE_TYPES = {
+    'dataset': pa.string(),
+    'pid': pa.string(),
+    'sample_time': pa.timestamp('us', tz='UTC'),
+    'ifcb': pa.int64(),
+    'ml_analyzed': pa.float64(),
+    'latitude': pa.float64(),
+    'longitude': pa.float64(),
+    'depth': pa.float64(),
+    'cruise': pa.string(),
+    'cast': pa.string(),
+    'niskin': pa.int64(),
+    'sample_type': pa.string(),
+    'n_images': pa.int64(),
+    'comment_summary': pa.string(),
+    'trigger_selection': pa.string(),
+    'skip': pa.int8(),
+}
+
+def export_key(kind, fmt, query):
+    # cache key identifying an export of the current data, as in cached_response
+    version = [data_version(query.get('dataset_name')), data_version(CATALOG_VERSION)]
+    params = json.dumps([kind, fmt, query, version], sort_keys=True)
+    return 'export_{}'.format(hashlib.sha1(params.encode('utf8')).hexdigest())
+
+def export_task_key(key):
+    return '{}_task'.format(key)
+
+def export_bins(query):
+    # query is a dict of bin_query arguments plus optional start_date and end_date
+    query = dict(query)
+    start_date = query.pop('start_date', None)
+    end_date = query.pop('end_date', None)
+    bin_qs = bin_query(**query)
+    if start_date:
+        bin_qs = bin_qs.filter(sample_time__gte=pd.to_datetime(start_date, utc=True))
+    if end_date:
+        bin_qs = bin_qs.filter(sample_time__lte=pd.to_datetime(end_date, utc=True) + pd.Timedelta('1d'))
+    return bin_qs
+
+def open_writer(path, schema, fmt):
+    if fmt == 'parquet':
+        return pq.ParquetWriter(path, schema)
+    return pa.ipc.new_file(path, schema)
+
+def conform(table, schema):
+    # cast a table to a schema, filling in any columns it doesn't have with nulls
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(len(table), field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def write_bin_table(ds, bins, path, fmt, progress_callback):
+    # write the same table export_metadata produces, a chunk of rows at a time
+    rows = export_metadata(ds, bins)
+    header = next(rows)
+    schema = pa.schema([(name, BIN_TABLE_TYPES.get(name, pa.string())) for name in header])
+    string_columns = [i for i, field in enumerate(schema) if field.type == pa.string()]
+    n_rows = 0
+    with open_writer(path, schema, fmt) as writer:
+        while True:
+            chunk = list(islice(rows, EXPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            columns = [list(c) for c in zip(*chunk)]
+            for i in string_columns:
+                columns[i] = [None if v is None or v == '' else str(v) for v in columns[i]]
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(c, type=f.type) for c, f in zip(columns, schema)], schema=schema))
+            n_rows += len(chunk)
+            progress_callback({'rows': n_rows})
+
+def roi_frame(b):
+    # ADC columns and features for each image in a bin, as in the plot data for a single bin
+    bin = b._get_bin()
+    with bin:
+        ia = bin.images_adc.copy()
+        column_names = schema_names(bin.schema)
+        # deal with ADC files with extra columns
+        for i in range(len(ia.columns) - len(column_names)):
+            column_names.append('unknown_{}'.format(i))
+        ia.columns = column_names[:len(ia.columns)]
+        ia.index = list(bin.images.keys())
+    if b.has_features():
+        ia = ia.join(b.features(), rsuffix='_feature')
+    ia.index.name = 'target_number'
+    ia = ia.reset_index()
+    ia.insert(0, 'pid', b.pid)
+    return ia
+
+def write_roi_table(bins, path, fmt, progress_callback):
+    # bins may not all have the same ADC columns or features, so batches of bins are written to
+    # temporary Arrow files, and then combined using a schema that has all of their columns
+    tmpdir = tempfile.mkdtemp(dir=os.path.dirname(path))
+    try:
+        parts = []
+        frames = []
+        def flush():
+            if not frames:
+                return
+            table = pa.Table.from_pandas(pd.concat(frames, ignore_index=True), preserve_index=False)
+            part = os.path.join(tmpdir, '{}.arrow'.format(len(parts)))
+            with pa.ipc.new_file(part, table.schema) as writer:
+                writer.write_table(table)
+            parts.append((part, table.schema))
+            frames.clear()
+        n_bins = 0
+        bin_qs = Bin.objects.filter(id__in=bins.values('id')).order_by('sample_time', 'pid')
+        for b in bin_qs.iterator():
+            try:
+                frames.append(roi_frame(b))
+            except KeyError: # raw data not found
+                continue
+            n_bins += 1
+            if len(frames) == ROI_BATCH_SIZE:
+                flush()
+                progress_callback({'bins': n_bins})
+        flush()
+        if not parts:
+            schema = pa.schema([('pid', pa.string()), ('target_number', pa.int64())])
+        else:
+            schema = pa.unify_schemas([s for _, s in parts], promote_options='permissive')
+        with open_writer(path, schema, fmt) as writer:
+            for part, _ in parts:
+                with pa.memory_map(part) as source:
+                    writer.write_table(conform(pa.ipc.open_file(source).read_all(), schema))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def prune_exports():
+    # remove exports that are older than the cache timeout
+    if not os.path.exists(settings.EXPORT_DIR):
+        return
+    cutoff = time.time() - settings.EXPORT_CACHE_TIMEOUT
+    for entry in os.scandir(settings.EXPORT_DIR):
+        if entry.is_file() and entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+def write_export(key, kind, fmt, query, progress_callback):
+    # write an export and cache its location under the key it was requested with. returns the cache entry
+    extension, _ = EXPORT_FORMATS[fmt]
+    os.makedirs(settings.EXPORT_DIR, exist_ok=True)
+    prune_exports()
+    path = os.path.join(settings.EXPORT_DIR, key + extension)
+    dataset_name = query.get('dataset_name')
+    bins = export_bins(query)
+    # write to a temporary file first so that a partial export is never downloaded
+    fd, tmp_path = tempfile.mkstemp(suffix=extension, dir=settings.EXPORT_DIR)
+    os.close(fd)
+    try:
+        if kind == 'bins':
+            ds = Dataset.objects.get(name=dataset_name) if dataset_name else None
+            write_bin_table(ds, bins, tmp_path, fmt, progress_callback)
+        else:
+            write_roi_table(bins, tmp_path, fmt, progress_callback)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    entry = {
+        'path': path,
+        'filename': '{}-{}{}'.format(dataset_name or 'ifcb', kind, extension),
+    }
+    cache.set(key, entry, timeout=settings.EXPORT_CACHE_TIMEOUT)
+    return entry
+
+def cached_export(key):
+    # return the cache entry for a finished export, if it's still available
+    entry = cache.get(key)
+    if entry is None or not os.path.exists(entry['path']):
+        return None
+    return entry
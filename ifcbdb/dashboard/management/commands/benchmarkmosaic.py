@@ -0,0 +1,84 @@
+import time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand, CommandError
+
+from skimage.transform import resize
+
+from dashboard.models import Bin
+from dashboard.mosaic import Mosaic, PACKERS, resize_area
+
+from common.utilities import parse_view_size
+
+class Command(BaseCommand):
+    help = 'compare mosaic packers, and ROI resizing against the scikit-image resize it replaced, using a bin\'s images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('pid', type=str, help='pid of bin whose images to use')
+        parser.add_argument('-s', '--scale', type=int, action='append', help='scale factor in percent (default: all mosaic scale factors)')
+        parser.add_argument('-v', '--view-size', type=str, action='append', help='mosaic view size, e.g. 800x600 (default: all mosaic view sizes)')
+        parser.add_argument('-r', '--repeat', type=int, default=3, help='number of times to time each method')
+
+    def handle(self, *args, **options):
+        try:
+            b = Bin.objects.get(pid=options['pid'])
+        except Bin.DoesNotExist:
+            raise CommandError('No such bin "{}"'.format(options['pid']))
+        scales = options['scale'] or Bin.MOSAIC_SCALE_FACTORS
+        view_sizes = options['view_size'] or Bin.MOSAIC_VIEW_SIZES
+        repeat = options['repeat']
+
+        the_bin = b._get_bin()
+        mosaic = Mosaic(the_bin)
+        with the_bin:
+            images = mosaic.images()
+            _, _, roi_numbers = mosaic.shapes()
+            rois = [np.asarray(images[n], dtype=np.uint8) for n in roi_numbers]
+        self.stdout.write('{}: {} images'.format(b.pid, len(rois)))
+
+        # packing: number of pages and time for each packer
+        for view_size in view_sizes:
+            shape = parse_view_size(view_size)
+            for scale_factor in scales:
+                results = []
+                for name in PACKERS:
+                    best = None
+                    for _ in range(repeat + 1): # the first run compiles the packer
+                        m = Mosaic(the_bin, shape=shape, scale=scale_factor / 100, packer=name)
+                        m.shapes() # read ROI sizes before timing
+                        then = time.time()
+                        coordinates = m.pack()
+                        elapsed = time.time() - then
+                        best = elapsed if best is None else min(best, elapsed)
+                    results.append('{} {} pages {:.1f}ms'.format(name, coordinates.page.max() + 1, best * 1000))
+                self.stdout.write('packing {} at {}%: {}'.format(view_size, scale_factor, ', '.join(results)))
+
+        # compile the kernel before timing it
+        resize_area(rois[0], np.empty((1, 1), dtype=np.uint8))
+
+        def skimage_resize(roi, dst):
+            dst[:] = resize(roi, dst.shape, mode='reflect', preserve_range=True)
+
+        for scale_factor in scales:
+            scale = scale_factor / 100
+            shapes = [(int(np.floor(roi.shape[0] * scale)), int(np.floor(roi.shape[1] * scale))) for roi in rois]
+            pairs = [(roi, shape) for roi, shape in zip(rois, shapes) if shape[0] > 0 and shape[1] > 0]
+            results = {}
+            timings = {}
+            for name, fn in [('skimage', skimage_resize), ('resize_area', resize_area)]:
+                best = None
+                for _ in range(repeat):
+                    outputs = [np.empty(shape, dtype=np.uint8) for _, shape in pairs]
+                    then = time.time()
+                    for (roi, _), dst in zip(pairs, outputs):
+                        fn(roi, dst)
+                    elapsed = time.time() - then
+                    best = elapsed if best is None else min(best, elapsed)
+                results[name] = outputs
+                timings[name] = best
+            diffs = np.concatenate([np.abs(a.astype(np.int16) - b.astype(np.int16)).ravel()
+                for a, b in zip(results['skimage'], results['resize_area'])])
+            self.stdout.write('scale {}%: skimage {:.1f}ms, resize_area {:.1f}ms ({:.1f}x), difference mean {:.2f} max {}'.format(
+                scale_factor, timings['skimage'] * 1000, timings['resize_area'] * 1000,
+                timings['skimage'] / max(timings['resize_area'], 1e-9), diffs.mean(), diffs.max()))
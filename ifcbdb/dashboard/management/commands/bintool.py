@@ -1,6 +1,8 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from dashboard.models import bin_query, Dataset
+from dashboard.rollups import update_rollups
+from dashboard.datacache import bump_data_version
 
 class Command(BaseCommand):
     help = 'Filter bins, optionally remove/add them from/to datasets, and output the list of bin IDs'
@@ -46,7 +48,11 @@ class Command(BaseCommand):
         if remove_dataset_name is not None:
             try:
                 dataset = Dataset.objects.get(name=remove_dataset_name)
+                # read the sample times first, since bins may be filtered on the dataset they're leaving
+                sample_times = list(bins.values_list('sample_time', flat=True))
                 dataset.bins.through.objects.filter(bin__in=bins, dataset=dataset).delete()
+                update_rollups([dataset.id], sample_times)
+                bump_data_version([dataset.name]) # deleting links directly doesn't send m2m_changed
                 self.stdout.write(f"Removed filtered bins from dataset: {remove_dataset_name}")
             except Dataset.DoesNotExist:
                 self.stderr.write(f"Dataset '{remove_dataset_name}' does not exist.")
@@ -55,6 +61,7 @@ class Command(BaseCommand):
             try:
                 dataset = Dataset.objects.get(name=add_dataset_name)
                 dataset.bins.add(*bins)
+                update_rollups([dataset.id], bins.values_list('sample_time', flat=True))
                 self.stdout.write(f"Added filtered bins to dataset: {add_dataset_name}")
             except Dataset.DoesNotExist:
                 self.stderr.write(f"Dataset '{add_dataset_name}' does not exist.")
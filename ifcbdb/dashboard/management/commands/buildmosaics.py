@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+
+from dashboard.models import Bin, Dataset, MosaicLayout
+from dashboard.mosaic import PACKERS, DEFAULT_PACKER
+from dashboard.pagecache import remove_pages
+
+from common.utilities import parse_view_size
+
+class Command(BaseCommand):
+    help = 'pack and store mosaic layouts, e.g. to prebuild them for existing bins or rebuild them after the packer changes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-d', '--dataset', type=str, help='only build layouts for bins in this dataset')
+        parser.add_argument('-s', '--scale', type=int, action='append', help='scale factor in percent (default: {})'.format(Bin.MOSAIC_DEFAULT_SCALE_FACTOR))
+        parser.add_argument('-v', '--view-size', type=str, action='append', help='mosaic view size, e.g. 800x600 (default: {})'.format(Bin.MOSAIC_DEFAULT_VIEW_SIZE))
+        parser.add_argument('-p', '--packer', type=str, default=DEFAULT_PACKER, choices=list(PACKERS), help='packer to use (default: {})'.format(DEFAULT_PACKER))
+        parser.add_argument('-m', '--missing', help='only build layouts that are not already stored', action='store_true')
+        parser.add_argument('--prune', help='delete stored layouts made by other packers', action='store_true')
+
+    def handle(self, *args, **options):
+        scales = options['scale'] or [Bin.MOSAIC_DEFAULT_SCALE_FACTOR]
+        view_sizes = options['view_size'] or [Bin.MOSAIC_DEFAULT_VIEW_SIZE]
+        packer = options['packer']
+        bins = Bin.objects.filter(skip=False)
+        if options['dataset']:
+            try:
+                dataset = Dataset.objects.get(name=options['dataset'])
+            except Dataset.DoesNotExist:
+                raise CommandError('No such dataset "{}"'.format(options['dataset']))
+            bins = bins.filter(datasets=dataset)
+        if options['prune']:
+            layouts = MosaicLayout.objects.exclude(packer=packer)
+            if options['dataset']:
+                layouts = layouts.filter(bin__in=bins)
+            n_deleted, _ = layouts.delete()
+            self.stdout.write('deleted {} layouts made by other packers'.format(n_deleted))
+        for view_size in view_sizes:
+            shape = parse_view_size(view_size)
+            for scale_factor in scales:
+                scale = scale_factor / 100
+                todo = bins
+                if options['missing']:
+                    stored = MosaicLayout.lookup(OuterRef('pk'), shape, scale, packer)
+                    todo = todo.filter(~Exists(stored))
+                n_built, n_errors = 0, 0
+                then = time.time()
+                for b in todo.order_by('pid').iterator():
+                    try:
+                        b.build_mosaic_layout(shape, scale, packer)
+                    except Exception as e:
+                        self.stderr.write('{}: {}'.format(b.pid, str(e)))
+                        n_errors += 1
+                        continue
+                    if packer == DEFAULT_PACKER: # the dashboard's cached pages are of the old layout
+                        remove_pages(b.pid, shape, scale)
+                    n_built += 1
+                self.stdout.write('{} at {}%: built {} layouts in {:.1f}s, {} errors'.format(
+                    view_size, scale_factor, n_built, time.time() - then, n_errors))
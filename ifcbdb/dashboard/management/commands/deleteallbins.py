@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand, CommandError
 
 from dashboard.models import Bin, Dataset
+from dashboard.rollups import rebuild_rollups
 
 class Command(BaseCommand):
     """for testing only!!"""
@@ -14,6 +15,10 @@ class Command(BaseCommand):
         ds_name = options.get('dataset')
         if ds_name is not None:
             ds = Dataset.objects.get(name=ds_name)
+            # the bins may be in other datasets too, whose rollups also have to be rebuilt
+            dataset_ids = list(Dataset.objects.filter(bins__in=ds.bins.all()).values_list('id', flat=True).distinct())
             ds.bins.all().delete()
         else:
+            dataset_ids = list(Dataset.objects.values_list('id', flat=True))
             Bin.objects.all().delete()
+        rebuild_rollups(dataset_ids)
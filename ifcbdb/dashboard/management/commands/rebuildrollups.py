@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from dashboard.models import Dataset
+from dashboard.rollups import rebuild_rollups
+
+class Command(BaseCommand):
+    help = 'rebuild timeline rollups from the bins table, e.g. after bins were changed outside the dashboard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-d', '--dataset', type=str, action='append', help='name of dataset to rebuild (default: all datasets)')
+
+    def handle(self, *args, **options):
+        datasets = Dataset.objects.order_by('name')
+        if options['dataset']:
+            datasets = datasets.filter(name__in=options['dataset'])
+            missing = set(options['dataset']) - set(datasets.values_list('name', flat=True))
+            if missing:
+                raise CommandError('No such dataset(s): {}'.format(', '.join(sorted(missing))))
+        for ds in datasets:
+            # one dataset at a time, so its rollups are never seen half-built
+            with transaction.atomic():
+                rebuild_rollups([ds.id])
+            self.stdout.write('rebuilt rollups for {}'.format(ds.name))
@@ -14,6 +14,10 @@ class Command(BaseCommand):
         parser.add_argument('-lon','--longitude', type=float, help='longitude to set all bins to')
         parser.add_argument('-d', '--depth', type=float, help='depth to set all bins to')
         parser.add_argument('-n', '--newest', help='only sync newest bins', action='store_true')
+        parser.add_argument('-i', '--incremental', help='only scan directories that changed since the last sync', action='store_true')
+        parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes to use for accession')
+        parser.add_argument('-r', '--restart', help='ignore the checkpoint left by an interrupted sync and start over', action='store_true')
+        parser.add_argument('-m', '--mosaics', help='pack the default mosaic layout of each bin as it is added', action='store_true')
 
     def handle(self, *args, **options):
         # handle arguments
@@ -22,6 +26,10 @@ class Command(BaseCommand):
         lon = options.get('longitude')
         depth = options.get('depth')
         newest_only = options.get('newest',False)
+        workers = options.get('workers')
+        incremental = options.get('incremental', False)
+        restart = options.get('restart', False)
+        mosaics = options.get('mosaics', False)
         if (lat is None and lon is not None) or (lat is not None and lon is None):
             raise ValueError('must set both lat and lon')
         try:
@@ -29,5 +37,6 @@ class Command(BaseCommand):
         except Dataset.DoesNotExist:
             self.stderr.write('No such dataset "{}"'.format(dataset_name))
             return
-        acc = Accession(d, lat=lat, lon=lon, depth=depth, newest_only=newest_only)
+        acc = Accession(d, lat=lat, lon=lon, depth=depth, newest_only=newest_only, workers=workers,
+            incremental=incremental, resume=not restart, mosaics=mosaics)
         acc.sync(progress_callback=lambda _: True, log_callback=print)
@@ -9,6 +9,8 @@ from tqdm import tqdm
 from tqdm._utils import _term_move_up
 
 from dashboard.models import Bin, bin_query
+from dashboard.rollups import update_bin_rollups
+from dashboard.datacache import bump_bin_data_version
 
 class Command(BaseCommand):
 
@@ -44,6 +46,8 @@ class Command(BaseCommand):
             bin.n_triggers = self.n_triggers(self.last_line(bin.adc_path()))
             objs.append(bin)
         res = Bin.objects.bulk_update(objs, ['n_triggers'])
+        update_bin_rollups([b.id for b in objs], [b.sample_time for b in objs])
+        bump_bin_data_version([b.id for b in objs]) # bulk updates don't send post_save
         pbar.update(res)
         if res == 0:
             pbar.write(self.clear_border + ("Error: Bins, " + str(objs) + " not updated! Continuing ..."))
@@ -76,11 +80,17 @@ class Command(BaseCommand):
             reader = csv.reader(csvin)
             row = next(reader)
             with transaction.atomic():
+                updated = []
                 for row in reader:
                     res = 0
                     res = Bin.objects.filter(pid=row[0]).update(n_triggers=row[1])
                     if res == 0:
                         print("Error: Bin, " + bin.pid + " not updated! Continuing ...")
+                    else:
+                        updated.append(row[0])
+                bins = Bin.objects.filter(pid__in=updated)
+                update_bin_rollups(bins.values_list('id', flat=True), bins.values_list('sample_time', flat=True))
+                bump_bin_data_version(bins.values_list('id', flat=True))
 
     def handle(self, *args, **options):
 
@@ -0,0 +1,86 @@
+import os
+import re
+import time
+import traceback
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from dashboard.models import Dataset, DataDirectory
+from dashboard.accession import Accession
+from dashboard.watch import FilesetWatcher
+
+from ifcb.data.files import Fileset, FilesetBin
+
+# number of times a batch of filesets is retried after accession fails before its filesets are dropped
+MAX_ATTEMPTS = 3
+
+class Command(BaseCommand):
+    help = 'watch raw data directories and add new bins as they arrive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', type=str, help='name of dataset to add bins to')
+        parser.add_argument('-b', '--batch-size', type=int, default=100, help='maximum number of bins to add at a time')
+        parser.add_argument('--debounce', type=float, default=2, help='seconds to wait after a fileset is written before adding it')
+        parser.add_argument('--interval', type=float, default=5, help='maximum seconds to wait before adding a partial batch')
+
+    def handle(self, *args, **options):
+        dataset_name = options['dataset']
+        batch_size = options['batch_size']
+        interval = options['interval']
+        try:
+            d = Dataset.objects.get(name=dataset_name)
+        except Dataset.DoesNotExist:
+            raise CommandError('No such dataset "{}"'.format(dataset_name))
+
+        roots = []
+        for dd in d.directories.filter(kind=DataDirectory.RAW).order_by('priority'):
+            if not os.path.exists(dd.path):
+                self.stderr.write('Directory "{}" does not exist, not watching it'.format(dd.path))
+                continue
+            # each directory has its own whitelist and blacklist, as in DataDirectory.get_raw_directory
+            roots.append((dd.path, dd, re.split(',', dd.whitelist), re.split(',', dd.blacklist)))
+        if not roots:
+            raise CommandError('Dataset "{}" has no raw data directories to watch'.format(dataset_name))
+
+        watcher = FilesetWatcher(roots, debounce=options['debounce'])
+        acc = Accession(d, batch_size=batch_size)
+        for root in roots:
+            self.stdout.write('watching {}'.format(root[0]))
+
+        ready = []
+        attempts = {} # fileset path -> number of failed attempts to add it
+        last_sync = time.time()
+        try:
+            while True:
+                watcher.read(timeout=1000)
+                ready.extend(r for r in watcher.ready() if r not in ready)
+                if not ready:
+                    continue
+                if len(ready) < batch_size and time.time() - last_sync < interval:
+                    continue
+                batch, ready = ready, []
+                last_sync = time.time()
+                # the connection may have been closed by the database while idle, or by a restart
+                close_old_connections()
+                try:
+                    bin_dds = [(FilesetBin(Fileset(path)), dd) for path, dd in batch]
+                    acc.sync(progress_callback=lambda _: True, log_callback=self.stdout.write, bin_dds=bin_dds)
+                except Exception:
+                    self.stderr.write('adding {} filesets failed:\n{}'.format(len(batch), traceback.format_exc()))
+                    close_old_connections()
+                    # retry them with the next batch, unless they've failed too many times
+                    for path, dd in batch:
+                        attempts[path] = attempts.get(path, 0) + 1
+                        if attempts[path] < MAX_ATTEMPTS:
+                            ready.append((path, dd))
+                        else:
+                            self.stderr.write('giving up on {}'.format(path))
+                            del attempts[path]
+                    continue
+                for path, _ in batch:
+                    attempts.pop(path, None)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
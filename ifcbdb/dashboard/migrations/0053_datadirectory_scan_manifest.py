@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0052_team_short_description'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datadirectory',
+            name='scan_manifest',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
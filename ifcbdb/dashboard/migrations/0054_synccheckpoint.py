@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 15:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0053_datadirectory_scan_manifest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.IntegerField(default=0)),
+                ('last_pid', models.CharField(blank=True, max_length=64)),
+                ('incremental', models.BooleanField(default=False)),
+                ('added', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('bad', models.IntegerField(default=0)),
+                ('timestamp', models.DateTimeField(auto_now=True)),
+                ('data_directory', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='dashboard.datadirectory')),
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='sync_checkpoint', to='dashboard.dataset')),
+            ],
+        ),
+    ]
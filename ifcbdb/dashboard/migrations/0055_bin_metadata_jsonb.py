@@ -0,0 +1,47 @@
+from django.db import migrations, models
+
+# header metadata is copied from the old text column in chunks of bin ids, each in its own
+# transaction, so a large table isn't locked or rewritten in one go
+CHUNK_SIZE = 20000
+
+def copy_metadata(apps, schema_editor):
+    Bin = apps.get_model('dashboard', 'Bin')
+    table = Bin._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(id), MAX(id) FROM {}'.format(table))
+        min_id, max_id = cursor.fetchone()
+    if min_id is None:
+        return
+    for start in range(min_id, max_id + 1, CHUNK_SIZE):
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute("UPDATE {} SET header_metadata = metadata::jsonb "
+                "WHERE id >= %s AND id < %s AND metadata <> '{{}}'".format(table),
+                [start, start + CHUNK_SIZE])
+
+def copy_metadata_back(apps, schema_editor):
+    Bin = apps.get_model('dashboard', 'Bin')
+    table = Bin._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('UPDATE {} SET metadata = header_metadata::text'.format(table))
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('dashboard', '0054_synccheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bin',
+            name='metadata',
+            field=models.JSONField(db_column='header_metadata', default=dict),
+        ),
+        migrations.RunPython(copy_metadata, copy_metadata_back, atomic=False),
+        migrations.RemoveField(
+            model_name='bin',
+            name='metadata_json',
+        ),
+    ]
@@ -0,0 +1,19 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('dashboard', '0055_bin_metadata_jsonb'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='bin',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['metadata'], name='bin_metadata_gin'),
+        ),
+    ]
@@ -0,0 +1,90 @@
+# Generated by Django 4.2.30 on 2026-10-17 16:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# a frozen copy of dashboard.rollups.rebuild_rollups for every dataset, as of this migration
+BUILD_ROLLUPS_SQL = """
+    INSERT INTO dashboard_timelinerollup (dataset_id, instrument_id, resolution, start, count,
+        size_sum, size_min, size_max,
+        temperature_sum, temperature_min, temperature_max,
+        humidity_sum, humidity_min, humidity_max,
+        run_time_sum, run_time_min, run_time_max,
+        look_time_sum, look_time_min, look_time_max,
+        ml_analyzed_sum, ml_analyzed_min, ml_analyzed_max,
+        concentration_sum, concentration_min, concentration_max,
+        n_triggers_sum, n_triggers_min, n_triggers_max,
+        n_images_sum, n_images_min, n_images_max)
+    SELECT bd.dataset_id, b.instrument_id, '{resolution}', date_trunc('{resolution}', b.sample_time), COUNT(*),
+        sum(b.size), min(b.size), max(b.size),
+        sum(b.temperature), min(b.temperature), max(b.temperature),
+        sum(b.humidity), min(b.humidity), max(b.humidity),
+        sum(b.run_time), min(b.run_time), max(b.run_time),
+        sum(b.look_time), min(b.look_time), max(b.look_time),
+        sum(b.ml_analyzed), min(b.ml_analyzed), max(b.ml_analyzed),
+        sum(b.concentration), min(b.concentration), max(b.concentration),
+        sum(b.n_triggers), min(b.n_triggers), max(b.n_triggers),
+        sum(b.n_images), min(b.n_images), max(b.n_images)
+    FROM dashboard_bin b JOIN dashboard_bin_datasets bd ON bd.bin_id = b.id
+    WHERE NOT b.skip
+    GROUP BY bd.dataset_id, b.instrument_id, date_trunc('{resolution}', b.sample_time)
+"""
+
+
+def build_rollups(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for resolution in ['hour', 'day', 'week']:
+            cursor.execute(BUILD_ROLLUPS_SQL.format(resolution=resolution))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0056_bin_metadata_gin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(max_length=8)),
+                ('start', models.DateTimeField()),
+                ('count', models.IntegerField(default=0)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='dashboard.dataset')),
+                ('instrument', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='dashboard.instrument')),
+                ('size_sum', models.FloatField(null=True)),
+                ('size_min', models.FloatField(null=True)),
+                ('size_max', models.FloatField(null=True)),
+                ('temperature_sum', models.FloatField(null=True)),
+                ('temperature_min', models.FloatField(null=True)),
+                ('temperature_max', models.FloatField(null=True)),
+                ('humidity_sum', models.FloatField(null=True)),
+                ('humidity_min', models.FloatField(null=True)),
+                ('humidity_max', models.FloatField(null=True)),
+                ('run_time_sum', models.FloatField(null=True)),
+                ('run_time_min', models.FloatField(null=True)),
+                ('run_time_max', models.FloatField(null=True)),
+                ('look_time_sum', models.FloatField(null=True)),
+                ('look_time_min', models.FloatField(null=True)),
+                ('look_time_max', models.FloatField(null=True)),
+                ('ml_analyzed_sum', models.FloatField(null=True)),
+                ('ml_analyzed_min', models.FloatField(null=True)),
+                ('ml_analyzed_max', models.FloatField(null=True)),
+                ('concentration_sum', models.FloatField(null=True)),
+                ('concentration_min', models.FloatField(null=True)),
+                ('concentration_max', models.FloatField(null=True)),
+                ('n_triggers_sum', models.FloatField(null=True)),
+                ('n_triggers_min', models.FloatField(null=True)),
+                ('n_triggers_max', models.FloatField(null=True)),
+                ('n_images_sum', models.FloatField(null=True)),
+                ('n_images_min', models.FloatField(null=True)),
+                ('n_images_max', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='timelinerollup',
+            index=models.Index(fields=['dataset', 'resolution', 'start'], name='rollup_dataset_start'),
+        ),
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('dashboard', '0057_timelinerollup'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='bin',
+            index=models.Index(fields=['sample_time', 'pid'], name='bin_sample_time_pid'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-17 18:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0058_bin_sample_time_pid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MosaicLayout',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('height', models.IntegerField()),
+                ('width', models.IntegerField()),
+                ('scale', models.IntegerField()),
+                ('packer', models.CharField(default='guillotine', max_length=32)),
+                ('coordinates', models.BinaryField()),
+                ('packed', models.DateTimeField(auto_now=True)),
+                ('bin', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mosaic_layouts', to='dashboard.bin')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='mosaiclayout',
+            constraint=models.UniqueConstraint(fields=('bin', 'height', 'width', 'scale', 'packer'), name='unique mosaic layout'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('dashboard', '0059_mosaiclayout'),
+    ]
+
+    operations = [
+        # a GiST index on bin locations as geography, so nearest bin queries can walk the index in order of
+        # distance on the earth rather than in degrees. Django can't express this index on the model
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS bin_location_geography ON dashboard_bin USING gist ((location::geography))',
+            'DROP INDEX CONCURRENTLY IF EXISTS bin_location_geography',
+        ),
+    ]
@@ -1,5 +1,4 @@
 import re
-import json
 import logging
 import os
 
@@ -9,8 +8,11 @@ from django.db import models
 
 from django.conf import settings
 
-from django.db.models import F, Count, Sum, Avg, Min, Max, Q
-from django.db.models.functions import Trunc
+from django.db.models import F, Count, Sum, Avg, Min, Max, Q, FloatField, Exists, OuterRef
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Trunc, Cast
+from django.contrib.postgres.indexes import GinIndex
 from django.contrib.auth.models import User
 from django.contrib.gis.db.models import PointField
 from django.contrib.gis.geos import Point, Polygon
@@ -37,7 +39,9 @@ from ifcb.data.transfer import RemoteIfcb
 from ifcb.data.files import Fileset, FilesetBin
 
 from .tasks import mosaic_coordinates_task
-from .mosaic import Mosaic
+from .mosaic import Mosaic, DEFAULT_PACKER, encode_layout, decode_layout
+from .scan import IncrementalScan
+from .rollups import ROLLUP_RESOLUTIONS, truncate
 
 from common.constants import TeamRoles
 
@@ -55,6 +59,15 @@ DEFAULT_ZOOM_LEVEL = 6
 def do_nothing(*args, **kw):
     pass
 
+# how many index candidates are considered per nearest bin requested
+KNN_CANDIDATES = 4
+# distance in meters on a sphere between bin locations and a point, in the form indexed by the
+# bin_location_geography index, so that ordering by it walks the index
+GEOGRAPHY_DISTANCE_SQL = '"dashboard_bin"."location"::geography <-> ST_GeogFromText(%s)'
+
+# matches numbers as they appear in JSON
+NUMBER_REGEX = r'^-?[0-9]+(\.[0-9]+)?([eE][-+]?[0-9]+)?$'
+
 class Timeline(object):
 
     TIMELINE_METRICS = {
@@ -69,10 +82,25 @@ class Timeline(object):
         'n_images': 'Count',
     }
 
-    def __init__(self, bin_qs, filter_skip=True):
+    # metrics named with this prefix are numeric header metadata values, e.g. header_PMTAhighVoltage
+    HEADER_METRIC_PREFIX = 'header_'
+
+    RESOLUTIONS = ['month', 'week', 'day', 'hour', 'bin', 'auto']
+
+    # aggregated values are plotted at the middle of their time bucket
+    RESOLUTION_OFFSETS = {
+        'bin': pd.Timedelta('0s'),
+        'hour': pd.Timedelta('30m'),
+        'day': pd.Timedelta('12h'),
+        'week': pd.Timedelta('3.5d'),
+    }
+
+    def __init__(self, bin_qs, filter_skip=True, rollups=None):
         self.bins = bin_qs
         if filter_skip:
             self.bins = self.bins.filter(skip=False)
+        # TimelineRollup queryset equivalent to bin_qs, if there is one
+        self.rollups = rollups if filter_skip else None
 
     def time_range(self, start_time=None, end_time=None):
         qs = self.bins
@@ -112,84 +140,95 @@ class Timeline(object):
         else:
             return previous_bin
 
-    def previous_bin(self, bin):
-        same_time = self.bins.filter(sample_time=bin.sample_time)
-        prev_time = self.bins.filter(sample_time__lt=bin.sample_time).order_by('-sample_time','-pid')
-        if same_time.count() == 1: # only bin with this sample time
-            return prev_time.first()
-        else:
-            prev = same_time.filter(pid__lt=bin.pid).order_by('-pid').first()
-            if prev is None:
-                return prev_time.first()
+    def adjacent_bins(self, bin):
+        # the bins before and after a bin in (sample_time, pid) order, in a single query.
+        # each side is an index scan on (sample_time, pid) that starts at the bin and stops at the first match
+        t, pid = bin.sample_time, bin.pid
+        prev_qs = self.bins.filter(sample_time__lte=t).exclude(sample_time=t, pid__gte=pid) \
+            .order_by('-sample_time', '-pid')[:1]
+        next_qs = self.bins.filter(sample_time__gte=t).exclude(sample_time=t, pid__lte=pid) \
+            .order_by('sample_time', 'pid')[:1]
+        previous_bin, next_bin = None, None
+        for b in prev_qs.union(next_qs, all=True):
+            if (b.sample_time, b.pid) < (t, pid):
+                previous_bin = b
             else:
-                return prev
+                next_bin = b
+        return previous_bin, next_bin
+
+    def previous_bin(self, bin):
+        return self.adjacent_bins(bin)[0]
 
     def next_bin(self, bin):
-        same_time = self.bins.filter(sample_time=bin.sample_time)
-        next_time = self.bins.filter(sample_time__gt=bin.sample_time).order_by('sample_time','pid')
-        if same_time.count() == 1:
-            return next_time.first()
-        else:
-            _next = same_time.filter(pid__gt=bin.pid).order_by('pid').first()
-            if _next is None:
-                return next_time.first()
-            else:
-                return _next
+        return self.adjacent_bins(bin)[1]
 
-    def nearest_bin(self, longitude, latitude):
+    def nearest_bins(self, longitude, latitude, k=1):
+        # the k located bins nearest a point, annotated with their distance in meters. candidates are found
+        # with the geography <-> operator, which walks the bin_location_geography index in order of distance
+        # on a sphere, and then ranked by their distance on the spheroid, which can differ slightly
         location = Point(longitude, latitude, srid=SRID)
-        return self.bins.annotate(
-            distance=Distance('location', location)
-        ).order_by('distance').first()
+        candidates = self.bins.filter(location__isnull=False) \
+            .order_by(RawSQL(GEOGRAPHY_DISTANCE_SQL, (location.ewkt,))) \
+            .annotate(distance=Distance('location', location))[:k * KNN_CANDIDATES]
+        return sorted(candidates, key=lambda b: b.distance.m)[:k]
+
+    def nearest_bin(self, longitude, latitude):
+        nearest = self.nearest_bins(longitude, latitude)
+        return nearest[0] if nearest else None
+
+    def auto_resolution(self, start_time=None, end_time=None):
+        # pick a time resolution for a time range, filling in either end of the range from the bins
+        if start_time is None or end_time is None:
+            mm = self.bins.aggregate(min=Min('sample_time'),max=Max('sample_time'))
+            min_sample_time, max_sample_time = mm['min'], mm['max']
+        if start_time is None:
+            start_time = min_sample_time
+        else:
+            start_time = pd.to_datetime(start_time, utc=True)
+        if end_time is None:
+            end_time = max_sample_time
+        else:
+            end_time = pd.to_datetime(end_time, utc=True)
+        time_range = end_time - start_time
+        if time_range < pd.Timedelta('7d'):
+            resolution = 'bin'
+        elif time_range < pd.Timedelta('60d'):
+            resolution = 'hour'
+        elif time_range < pd.Timedelta('1095d'): # 3 years
+            resolution = 'day'
+        else:
+            resolution = 'week'
+        return start_time, end_time, resolution
 
     def metrics(self, metric, start_time=None, end_time=None, resolution='day', apply_offset=True):
-        if resolution not in ['month', 'week', 'day', 'hour', 'bin', 'auto']:
+        if resolution not in self.RESOLUTIONS:
             raise ValueError('unsupported time resolution {}'.format(resolution))
 
-        if metric not in self.TIMELINE_METRICS.keys():
-            raise ValueError('unsupported metric {}'.format(metric))
+        qs, value = self.metric_expression(metric)
 
         if resolution == 'auto':
-            if start_time is None or end_time is None:
-                mm = self.bins.aggregate(min=Min('sample_time'),max=Max('sample_time'))
-                min_sample_time, max_sample_time = mm['min'], mm['max']
-            if start_time is None:
-                start_time = min_sample_time
-            else:
-                start_time = pd.to_datetime(start_time, utc=True)
-            if end_time is None:
-                end_time = max_sample_time
-            else:
-                end_time = pd.to_datetime(end_time, utc=True)
-            time_range = end_time - start_time
-            if time_range < pd.Timedelta('7d'):
-                resolution = 'bin'
-            elif time_range < pd.Timedelta('60d'):
-                resolution = 'hour'
-            elif time_range < pd.Timedelta('1095d'): # 3 years
-                resolution = 'day'
-            else:
-                resolution = 'week'
+            start_time, end_time, resolution = self.auto_resolution(start_time, end_time)
 
         if apply_offset:
-            if resolution == 'bin':
-                offset = pd.Timedelta('0s')
-            elif resolution == 'hour':
-                offset = pd.Timedelta('30m')
-            elif resolution == 'day':
-                offset = pd.Timedelta('12h')
-            elif resolution == 'week':
-                offset = pd.Timedelta('3.5d')
-                
-        qs = self.time_range(start_time, end_time)
+            offset = self.RESOLUTION_OFFSETS.get(resolution, pd.Timedelta('0s'))
+
+        if self.rollups is not None and resolution in ROLLUP_RESOLUTIONS and metric in self.TIMELINE_METRICS:
+            result = [{ 'dt': r['dt'], 'metric': r[metric] }
+                for r in self.rollup_metrics([metric], start_time, end_time, resolution)]
+            if apply_offset:
+                for record in result:
+                    record['dt'] += offset
+            return result, resolution
+
+        qs = Timeline(qs, filter_skip=False).time_range(start_time, end_time)
 
         aggregate_fn = Avg
 
         if resolution == 'bin':
-            result = qs.annotate(dt=F('sample_time'),metric=F(metric)).values('dt','metric').order_by('dt')
+            result = qs.annotate(dt=F('sample_time'),metric=value).values('dt','metric').order_by('dt')
         else:
             result = qs.annotate(dt=Trunc('sample_time', resolution)). \
-                    values('dt').annotate(metric=aggregate_fn(metric)).order_by('dt')
+                    values('dt').annotate(metric=aggregate_fn(value)).order_by('dt')
 
             if apply_offset:
                 for record in result:
@@ -197,6 +236,68 @@ class Timeline(object):
 
         return result, resolution
 
+    def multi_metrics(self, metrics, start_time=None, end_time=None, resolution='day', apply_offset=True):
+        # several TIMELINE_METRICS aggregated in one query. returns a list of records with dt and
+        # each metric, and the resolution
+        if resolution not in self.RESOLUTIONS:
+            raise ValueError('unsupported time resolution {}'.format(resolution))
+        for metric in metrics:
+            if metric not in self.TIMELINE_METRICS:
+                raise ValueError('unsupported metric {}'.format(metric))
+
+        if resolution == 'auto':
+            start_time, end_time, resolution = self.auto_resolution(start_time, end_time)
+
+        if self.rollups is not None and resolution in ROLLUP_RESOLUTIONS:
+            result = self.rollup_metrics(metrics, start_time, end_time, resolution)
+        else:
+            qs = self.time_range(start_time, end_time)
+            if resolution == 'bin':
+                result = qs.annotate(dt=F('sample_time')).values('dt', *metrics).order_by('dt')
+            else:
+                result = qs.annotate(dt=Trunc('sample_time', resolution)).values('dt') \
+                    .annotate(**{ metric: Avg(metric) for metric in metrics }).order_by('dt')
+            result = list(result)
+
+        if apply_offset:
+            offset = self.RESOLUTION_OFFSETS.get(resolution, pd.Timedelta('0s'))
+            for record in result:
+                record['dt'] += offset
+
+        return result, resolution
+
+    def rollup_metrics(self, metrics, start_time, end_time, resolution):
+        # average of metrics per time bucket, from the rollups. buckets partly in the time range are included
+        qs = self.rollups.filter(resolution=resolution)
+        if start_time is not None:
+            qs = qs.filter(start__gte=truncate(start_time, resolution))
+        if end_time is not None:
+            qs = qs.filter(start__lte=pd.to_datetime(end_time, utc=True))
+        totals = { 'total_{}'.format(metric): Sum('{}_sum'.format(metric)) for metric in metrics }
+        qs = qs.values('start').annotate(n=Sum('count'), **totals).order_by('start')
+        result = []
+        for r in qs:
+            if not r['n']:
+                continue
+            record = { 'dt': r['start'] }
+            for metric in metrics:
+                total = r['total_{}'.format(metric)]
+                record[metric] = total / r['n'] if total is not None else None
+            result.append(record)
+        return result
+
+    def metric_expression(self, metric):
+        # returns the bins that have a value for the metric, and an expression for the value
+        if metric in self.TIMELINE_METRICS:
+            return self.bins, F(metric)
+        if metric.startswith(self.HEADER_METRIC_PREFIX):
+            key = metric[len(self.HEADER_METRIC_PREFIX):]
+            if re.fullmatch(r'\w+', key):
+                # only bins whose value for the key is a number can be cast in the database
+                qs = self.bins.filter(**{'metadata__{}__regex'.format(key): NUMBER_REGEX})
+                return qs, Cast(KeyTextTransform(key, 'metadata'), FloatField())
+        raise ValueError('unsupported metric {}'.format(metric))
+
     @classmethod
     def metric_label(cls, metric):
         return cls.TIMELINE_METRICS.get(metric,'')
@@ -344,31 +445,37 @@ class Dataset(models.Model):
         ds = Bin.objects.filter(location__contained=bbox).values('datasets').distinct()
         return ds
 
+    @staticmethod
+    def has_bins(*args, **kwargs):
+        # correlated EXISTS subquery for datasets that have bins matching the filters, so that the bins
+        # don't have to be joined (or loaded). each condition is a separate subquery, so as before they
+        # need not be satisfied by the same bin
+        return Exists(Bin.objects.filter(*args, datasets=OuterRef('pk'), **kwargs))
+
     @staticmethod
     def search(start_date=None, end_date=None, min_depth=None, max_depth=None, region=None, dataset_id=None):
-        # TODO: Check into optimizing query
-        datasets = Dataset.objects.filter(is_active=True).prefetch_related("bins")
+        datasets = Dataset.objects.filter(is_active=True)
 
         # Handle start/end dates
         if start_date and end_date:
-            datasets = datasets.filter(bins__timestamp__range=[start_date, end_date])
+            datasets = datasets.filter(Dataset.has_bins(timestamp__range=[start_date, end_date]))
         elif start_date:
-            datasets = datasets.filter(bins__timestamp__gte=start_date)
+            datasets = datasets.filter(Dataset.has_bins(timestamp__gte=start_date))
         elif end_date:
-            datasets = datasets.filter(bins__timestamp__lt=end_date)
+            datasets = datasets.filter(Dataset.has_bins(timestamp__lt=end_date))
 
         # Handle min/max depth
         if min_depth and max_depth:
-            datasets = datasets.filter(Q(bins__depth__range=[min_depth, max_depth]) | Q(depth__range=[min_depth, max_depth]))
+            datasets = datasets.filter(Dataset.has_bins(depth__range=[min_depth, max_depth]) | Q(depth__range=[min_depth, max_depth]))
         elif min_depth:
-            datasets = datasets.filter(Q(bins__depth__gte=min_depth) | Q(depth__gte=min_depth))
+            datasets = datasets.filter(Dataset.has_bins(depth__gte=min_depth) | Q(depth__gte=min_depth))
         elif max_depth:
-            datasets = datasets.filter(Q(bins__depth__lte=max_depth) | Q(depth__lte=max_depth))
+            datasets = datasets.filter(Dataset.has_bins(depth__lte=max_depth) | Q(depth__lte=max_depth))
 
         # Handle region; requires an array of sw_lon, sw_lat, ne_lon, ne_lat
         if region:
             bbox = Polygon.from_bbox(region)
-            datasets = datasets.filter(Q(bins__location__contained=bbox) | Q(location__contained=bbox))
+            datasets = datasets.filter(Dataset.has_bins(location__contained=bbox) | Q(location__contained=bbox))
 
         if dataset_id:
             datasets = datasets.filter(pk=dataset_id)
@@ -377,16 +484,15 @@ class Dataset(models.Model):
 
     @staticmethod
     def search_fixed_locations(start_date=None, end_date=None, min_depth=None, max_depth=None, region=None, dataset_id=None):
-        # TODO: Check into optimizing query
-        datasets = Dataset.objects.exclude(location__isnull=True).filter(is_active=True).prefetch_related("bins")
+        datasets = Dataset.objects.exclude(location__isnull=True).filter(is_active=True)
 
         # Handle start/end dates
         if start_date and end_date:
-            datasets = datasets.filter(bins__sample_time__range=[start_date, end_date])
+            datasets = datasets.filter(Dataset.has_bins(sample_time__range=[start_date, end_date]))
         elif start_date:
-            datasets = datasets.filter(bins__sample_time__gte=start_date)
+            datasets = datasets.filter(Dataset.has_bins(sample_time__gte=start_date))
         elif end_date:
-            datasets = datasets.filter(bins__sample_time__lt=end_date)
+            datasets = datasets.filter(Dataset.has_bins(sample_time__lt=end_date))
 
         # Handle min/max depth
         if min_depth and max_depth:
@@ -451,6 +557,8 @@ class DataDirectory(models.Model):
     kind = models.CharField(max_length=32, default=RAW)
     priority = models.IntegerField(default=1) # order in which directories are searched (lower ealier)
     last_synced = models.DateTimeField('time of last db sync', blank=True, null=True)
+    # directory modification times recorded by the last successful incremental sync
+    scan_manifest = models.JSONField(default=dict, blank=True)
     # parameters controlling searching (simple comma separated fields because we don't have to query on these)
     whitelist = models.CharField(max_length=512, default='data') # comma separated list of directory names to search
     blacklist = models.CharField(max_length=512, default='skip,bad') # comma separated list of directory names to skip
@@ -465,6 +573,14 @@ class DataDirectory(models.Model):
         blacklist = re.split(',', self.blacklist)
         return ifcb.DataDirectory(self.path, whitelist=whitelist, blacklist=blacklist)
 
+    def get_incremental_scan(self):
+        if self.kind != self.RAW:
+            raise ValueError('not a raw directory')
+        # return a scan that skips subdirectories unchanged since the last successful sync
+        whitelist = re.split(',', self.whitelist)
+        blacklist = re.split(',', self.blacklist)
+        return IncrementalScan(self.path, self.scan_manifest, whitelist=whitelist, blacklist=blacklist)
+
     def raw_destination(self, bin_id):
         # where to put an incoming bin with the given id
         return self.path # FIXME support year/day directories
@@ -492,6 +608,76 @@ class DataDirectory(models.Model):
             models.UniqueConstraint(fields=['dataset', 'path', 'kind'], name='unique path')
         ]
 
+class SyncCheckpoint(models.Model):
+    # how far an interrupted sync of a dataset got, so the next sync can pick up where it left off.
+    # written in the same transaction as each batch of bins, and deleted when a sync completes
+    dataset = models.OneToOneField(Dataset, on_delete=models.CASCADE, related_name='sync_checkpoint')
+    # the directory being scanned and the number of filesets in it that have been committed
+    data_directory = models.ForeignKey(DataDirectory, null=True, on_delete=models.CASCADE)
+    position = models.IntegerField(default=0)
+    last_pid = models.CharField(max_length=64, blank=True) # last bin committed, to check the position
+    incremental = models.BooleanField(default=False) # positions in an incremental scan differ from a full one
+    # running totals, so that progress reporting continues from where it stopped
+    added = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+    bad = models.IntegerField(default=0)
+    timestamp = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} at {} ({})'.format(self.dataset, self.last_pid, self.position)
+
+class TimelineRollup(models.Model):
+    # sum, min and max of each timeline metric over the unskipped bins in a dataset from one instrument,
+    # in an hour, day or week starting at start. maintained by dashboard.rollups
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name='rollups')
+    instrument = models.ForeignKey('Instrument', null=True, on_delete=models.CASCADE)
+    resolution = models.CharField(max_length=8)
+    start = models.DateTimeField()
+    count = models.IntegerField(default=0)
+    # one column for each of rollups.rollup_columns()
+    size_sum = models.FloatField(null=True)
+    size_min = models.FloatField(null=True)
+    size_max = models.FloatField(null=True)
+    temperature_sum = models.FloatField(null=True)
+    temperature_min = models.FloatField(null=True)
+    temperature_max = models.FloatField(null=True)
+    humidity_sum = models.FloatField(null=True)
+    humidity_min = models.FloatField(null=True)
+    humidity_max = models.FloatField(null=True)
+    run_time_sum = models.FloatField(null=True)
+    run_time_min = models.FloatField(null=True)
+    run_time_max = models.FloatField(null=True)
+    look_time_sum = models.FloatField(null=True)
+    look_time_min = models.FloatField(null=True)
+    look_time_max = models.FloatField(null=True)
+    ml_analyzed_sum = models.FloatField(null=True)
+    ml_analyzed_min = models.FloatField(null=True)
+    ml_analyzed_max = models.FloatField(null=True)
+    concentration_sum = models.FloatField(null=True)
+    concentration_min = models.FloatField(null=True)
+    concentration_max = models.FloatField(null=True)
+    n_triggers_sum = models.FloatField(null=True)
+    n_triggers_min = models.FloatField(null=True)
+    n_triggers_max = models.FloatField(null=True)
+    n_images_sum = models.FloatField(null=True)
+    n_images_min = models.FloatField(null=True)
+    n_images_max = models.FloatField(null=True)
+
+    @staticmethod
+    def query(dataset_name=None, instrument_number=None):
+        # rollups for a dataset, optionally restricted to an instrument. rollups don't span datasets
+        if not dataset_name:
+            return None
+        qs = TimelineRollup.objects.filter(dataset__name=dataset_name)
+        if instrument_number not in [None, "", 0]:
+            qs = qs.filter(instrument__number=instrument_number)
+        return qs
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['dataset', 'resolution', 'start'], name='rollup_dataset_start'),
+        ]
+
 class Bin(models.Model):
     # bin's permanent identifier (e.g., D20190102T1234_IFCB927)
     pid = models.CharField(max_length=64, unique=True)
@@ -514,8 +700,8 @@ class Bin(models.Model):
     qc_bad = models.BooleanField(default=False) # is this bin invalid
     qc_no_rois = models.BooleanField(default=False)
     skip = models.BooleanField(default=False) # user wants to ignore this file
-    # metadata JSON
-    metadata_json = models.CharField(max_length=8192, default='{}', db_column='metadata')
+    # header metadata
+    metadata = models.JSONField(default=dict, db_column='header_metadata')
     # metrics
     size = models.BigIntegerField(default=0) # size of raw data in bytes
     n_triggers = models.IntegerField(default=0)
@@ -597,10 +783,6 @@ class Bin(models.Model):
 
         return self.n_triggers / self.run_time
     
-    @property
-    def metadata(self):
-        return json.loads(self.metadata_json)
-    
     def set_ml_analyzed(self, ml_analyzed):
         self.ml_analyzed = ml_analyzed
         self.concentration = self.n_images / ml_analyzed
@@ -628,7 +810,7 @@ class Bin(models.Model):
                 if not self.path: # cache path of first found fileset
                     self.path, _  = os.path.splitext(b.fileset.adc_path)
                     self.data_directory = directory
-                    self.save()
+                    self.save(update_fields=['path', 'data_directory'])
                 return b
             except KeyError:
                 pass # keep searching
@@ -755,13 +937,25 @@ class Bin(models.Model):
 
     # mosaics
 
-    def mosaic_coordinates(self, shape=(600, 800), scale=0.33, block=True):
+    def mosaic_cache_key(self, shape, scale, packer=DEFAULT_PACKER):
         h, w = shape
         cache_key = 'mosaic_coords_{}_{}x{}_{}'.format(self.pid, h, w, int(scale*100))
+        if packer != DEFAULT_PACKER:
+            cache_key += '_' + packer
+        return cache_key
+
+    def mosaic_coordinates(self, shape=(600, 800), scale=0.33, block=True, packer=DEFAULT_PACKER):
+        # layouts are cached, and stored in the database in case they're evicted from the cache
+        cache_key = self.mosaic_cache_key(shape, scale, packer)
         cached = cache.get(cache_key)
         if cached is not None:
             return pd.DataFrame.from_dict(cached)
-        task = mosaic_coordinates_task.delay(self.pid, shape, scale, cache_key)
+        layout = MosaicLayout.lookup(self, shape, scale, packer).values_list('coordinates', flat=True).first()
+        if layout is not None:
+            coordinates = decode_layout(layout)
+            cache.set(cache_key, coordinates.to_dict('list'))
+            return coordinates
+        task = mosaic_coordinates_task.delay(self.pid, shape, scale, cache_key, packer)
         if block:
             try:
                 d = task.get()
@@ -770,13 +964,28 @@ class Bin(models.Model):
                 return pd.DataFrame()
         return None
 
-    def mosaic(self, page=0, shape=(600,800), scale=0.33, bg_color=200):
+    def build_mosaic_layout(self, shape=(600, 800), scale=0.33, packer=DEFAULT_PACKER):
+        # pack a mosaic layout, replacing any stored or cached one, and return its coordinates
+        m = Mosaic(self._get_bin(), shape=shape, scale=scale, packer=packer)
+        coordinates = m.pack()
+        MosaicLayout.store(self, shape, scale, packer, coordinates)
+        cache.set(self.mosaic_cache_key(shape, scale, packer), coordinates.to_dict('list'))
+        return coordinates
+
+    def mosaic(self, page=0, shape=(600,800), scale=0.33, bg_color=200, packer=DEFAULT_PACKER):
         b = self._get_bin()
-        coordinates = self.mosaic_coordinates(shape, scale)
+        coordinates = self.mosaic_coordinates(shape, scale, packer=packer)
         m = Mosaic(b, shape, scale=scale, bg_color=bg_color, coordinates=coordinates)
         image = m.page(page)
         return image, coordinates        
 
+    def mosaic_pages(self, page_numbers=None, shape=(600,800), scale=0.33, bg_color=200, packer=DEFAULT_PACKER):
+        # pages of the mosaic (by default, all of them), rendered in one pass over the bin's ROIs
+        b = self._get_bin()
+        coordinates = self.mosaic_coordinates(shape, scale, packer=packer)
+        m = Mosaic(b, shape, scale=scale, bg_color=bg_color, coordinates=coordinates)
+        return m.pages(page_numbers), coordinates
+
     def target_id(self, target_number):
         return ifcb.Pid(self.pid).with_target(target_number)
 
@@ -886,6 +1095,44 @@ class Bin(models.Model):
     def __str__(self):
         return self.pid
 
+    class Meta:
+        indexes = [
+            GinIndex(fields=['metadata'], name='bin_metadata_gin'),
+            models.Index(fields=['sample_time', 'pid'], name='bin_sample_time_pid'),
+        ]
+
+
+class MosaicLayout(models.Model):
+    # packed mosaic coordinates for a bin at a view size and scale, so that layouts evicted from the cache
+    # don't have to be packed again. scale is a percentage, and coordinates are encoded by encode_layout
+    bin = models.ForeignKey(Bin, on_delete=models.CASCADE, related_name='mosaic_layouts')
+    height = models.IntegerField()
+    width = models.IntegerField()
+    scale = models.IntegerField()
+    packer = models.CharField(max_length=32, default=DEFAULT_PACKER)
+    coordinates = models.BinaryField()
+    packed = models.DateTimeField(auto_now=True)
+
+    @staticmethod
+    def key(bin, shape, scale, packer=DEFAULT_PACKER):
+        # field values identifying a bin's layout, given a (height, width) shape and a fractional scale
+        h, w = shape
+        return { 'bin': bin, 'height': h, 'width': w, 'scale': round(scale * 100), 'packer': packer }
+
+    @staticmethod
+    def lookup(bin, shape, scale, packer=DEFAULT_PACKER):
+        return MosaicLayout.objects.filter(**MosaicLayout.key(bin, shape, scale, packer))
+
+    @staticmethod
+    def store(bin, shape, scale, packer, coordinates):
+        MosaicLayout.objects.update_or_create(**MosaicLayout.key(bin, shape, scale, packer),
+            defaults={ 'coordinates': encode_layout(coordinates) })
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['bin', 'height', 'width', 'scale', 'packer'], name='unique mosaic layout')
+        ]
+
 
 class Instrument(models.Model):
     number = models.IntegerField(unique=True)
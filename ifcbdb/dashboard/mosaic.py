@@ -2,16 +2,17 @@ import numba as nb
 import numpy as np
 import pandas as pd 
 
+from io import BytesIO
+
 from numba.experimental import jitclass
 
 from functools import lru_cache
-import math
-
-from skimage.transform import resize
 
 from ifcb.data.adc import SCHEMA_VERSION_1
 from ifcb.data.stitching import InfilledImages
 
+from .roi import roi_geometry
+
 # numba implementation of bin packing algorithm
 
 DOESNT_FIT = -9999999
@@ -230,9 +231,151 @@ def pack(w, h, ws, hs, xs, ys, pages):
             pages[i] = page
         page += 1
 
+# numba implementation of a skyline packer. faster than the guillotine packer above, since it only
+# considers the segments of the skyline (the top edge of what's been placed) rather than every free
+# section, at the cost of leaving the space under overhangs unused
+
+@nb.jit(nopython=True)
+def skyline_fit(sx, sy, sw, i, w, h, page_w, page_h):
+    # the y at which a rect with its left edge at the start of skyline segment i would rest, or -1
+    x = sx[i]
+    if x + w > page_w:
+        return -1
+    y = 0
+    remaining = w
+    j = i
+    while remaining > 0:
+        y = max(y, sy[j])
+        if y + h > page_h:
+            return -1
+        remaining -= sw[j]
+        j += 1
+    return y
+
+@nb.jit(nopython=True)
+def skyline_place(sx, sy, sw, n_segments, i, w, top):
+    # raise the skyline to top over a rect of width w placed at the start of segment i.
+    # returns the new number of segments
+    for k in range(n_segments, i, -1):
+        sx[k], sy[k], sw[k] = sx[k - 1], sy[k - 1], sw[k - 1]
+    sy[i] = top
+    sw[i] = w
+    n_segments += 1
+    # trim or remove the segments the rect covers
+    right = sx[i] + w
+    k = i + 1
+    while k < n_segments and sx[k] < right:
+        overlap = right - sx[k]
+        if sw[k] <= overlap:
+            for m in range(k, n_segments - 1):
+                sx[m], sy[m], sw[m] = sx[m + 1], sy[m + 1], sw[m + 1]
+            n_segments -= 1
+        else:
+            sx[k] += overlap
+            sw[k] -= overlap
+            break
+    # merge neighboring segments at the same height
+    k = 0
+    while k < n_segments - 1:
+        if sy[k] == sy[k + 1]:
+            sw[k] += sw[k + 1]
+            for m in range(k + 1, n_segments - 1):
+                sx[m], sy[m], sw[m] = sx[m + 1], sy[m + 1], sw[m + 1]
+            n_segments -= 1
+        else:
+            k += 1
+    return n_segments
+
+@nb.jit(nopython=True)
+def pack_skyline(w, h, ws, hs, xs, ys, pages):
+    # same arguments as pack. each rect goes where its top edge will be lowest, leftmost on ties
+    n = len(ws)
+    sx = np.zeros(n + 2, dtype=np.int32)
+    sy = np.zeros(n + 2, dtype=np.int32)
+    sw = np.zeros(n + 2, dtype=np.int32)
+    need_more_pages = True
+    page = 1
+    while need_more_pages:
+        sx[0], sy[0], sw[0] = 0, 0, w
+        n_segments = 1
+        need_more_pages = False
+        placed = False
+        for i in range(n):
+            if pages[i] > 0: # already placed
+                continue
+            best_segment, best_top = -1, -1
+            for j in range(n_segments):
+                y = skyline_fit(sx, sy, sw, j, ws[i], hs[i], w, h)
+                if y < 0:
+                    continue
+                if best_segment == -1 or y + hs[i] < best_top:
+                    best_segment, best_top = j, y + hs[i]
+            if best_segment == -1:
+                need_more_pages = True
+                continue
+            xs[i], ys[i] = sx[best_segment], best_top - hs[i]
+            pages[i] = page
+            placed = True
+            n_segments = skyline_place(sx, sy, sw, n_segments, best_segment, ws[i], best_top)
+        if not placed: # remaining rects are larger than a page
+            break
+        page += 1
+
+# packing algorithms by name. guillotine fills pages more tightly, skyline is faster for bins with many ROIs
+PACKERS = {
+    'guillotine': pack,
+    'skyline': pack_skyline,
+}
+DEFAULT_PACKER = 'guillotine'
+
+# packed layouts are stored as compressed npz data of the coordinate columns
+
+LAYOUT_COLUMNS = ['page', 'y', 'x', 'h', 'w', 'roi_number']
+
+def encode_layout(coordinates):
+    buf = BytesIO()
+    np.savez_compressed(buf, **{ c: coordinates[c].values.astype(np.int32) for c in LAYOUT_COLUMNS })
+    return buf.getvalue()
+
+def decode_layout(data):
+    with np.load(BytesIO(bytes(data))) as arrays:
+        return pd.DataFrame({ c: arrays[c] for c in LAYOUT_COLUMNS })
+
+# area-averaging resize of uint8 images, for scaling ROIs into mosaic pages. compiled code is cached on
+# disk, so that each web worker doesn't compile it again when it renders its first mosaic
+
+@nb.jit(nopython=True, cache=True)
+def resize_area(src, dst):
+    # each destination pixel is the mean of the source pixels it covers, weighted by how much of
+    # each is covered. writes into dst, which can be a slice of a larger image
+    sh, sw = src.shape
+    dh, dw = dst.shape
+    fy = sh / dh
+    fx = sw / dw
+    for i in range(dh):
+        y0 = i * fy
+        y1 = y0 + fy
+        for j in range(dw):
+            x0 = j * fx
+            x1 = x0 + fx
+            total = 0.0
+            area = 0.0
+            for yy in range(int(y0), min(int(np.ceil(y1)), sh)):
+                wy = min(y1, yy + 1) - max(y0, yy)
+                if wy <= 0:
+                    continue
+                for xx in range(int(x0), min(int(np.ceil(x1)), sw)):
+                    wx = min(x1, xx + 1) - max(x0, xx)
+                    if wx <= 0:
+                        continue
+                    total += src[yy, xx] * wy * wx
+                    area += wy * wx
+            dst[i, j] = np.uint8(min(total / area + 0.5, 255))
+
 class Mosaic(object):
-    def __init__(self, the_bin, shape=(600, 800), scale=0.33, bg_color=200, coordinates=None):
+    def __init__(self, the_bin, shape=(600, 800), scale=0.33, bg_color=200, coordinates=None, packer=DEFAULT_PACKER):
         self.bin = the_bin
+        self.packer = PACKERS[packer]
         self.shape = shape
         self.bg_color = bg_color
         self.scale = scale
@@ -241,20 +384,11 @@ class Mosaic(object):
     def shapes(self):
         if self._shapes is not None:
             return self._shapes
-        hs, ws, ix = [], [], []
         with self.bin:
-            if self.bin.schema == SCHEMA_VERSION_1:
-                ii = InfilledImages(self.bin)
-            else:
-                ii = self.bin.images
-            for target_number in ii:
-                h, w = ii.shape(target_number)
-                hs.append(math.floor(h * self.scale))
-                ws.append(math.floor(w * self.scale))
-                ix.append(target_number)
-        self._shapes = (np.array(hs, dtype=np.int32),
-                        np.array(ws, dtype=np.int32),
-                        np.array(ix, dtype=np.int32))
+            ix, ws, hs = roi_geometry(self.bin)
+        self._shapes = (np.floor(hs * self.scale).astype(np.int32),
+                        np.floor(ws * self.scale).astype(np.int32),
+                        ix)
         return self._shapes
     def pack(self, max_pages=None):
         if self.coordinates is not None:
@@ -270,7 +404,7 @@ class Mosaic(object):
         pages = np.zeros(len(ids), dtype=np.int32)
         H, W = self.shape
 
-        pack(H, W, hs, ws, ys, xs, pages)
+        self.packer(H, W, hs, ws, ys, xs, pages)
 
         pages -= 1
         self.coordinates = pd.DataFrame({
@@ -282,20 +416,40 @@ class Mosaic(object):
             'roi_number': ids
             })
         return self.coordinates
+    def images(self):
+        # ROI images by ROI number, stitched for schema version 1 bins. the bin must be open
+        if self.bin.schema == SCHEMA_VERSION_1:
+            return InfilledImages(self.bin)
+        return self.bin.images
+    def paste(self, page_image, images, row):
+        y, x = row.y, row.x
+        h, w = row.h, row.w
+        if h == 0 or w == 0:
+            return
+        unscaled_image = np.asarray(images[row.roi_number], dtype=np.uint8)
+        resize_area(unscaled_image, page_image[y:y+h, x:x+w])
     def page(self, page=0):
+        return self.pages([page])[0]
+    def n_pages(self):
+        df = self.pack()
+        return int(df.page.max()) + 1 if len(df) and df.page.max() >= 0 else 1
+    def pages(self, page_numbers=None):
+        # render pages (by default, all of them) in a single pass over their ROIs, reading them in the order
+        # they're stored in the ROI file rather than page by page. returns a list of page images in the order
+        # of page_numbers. ROIs that didn't fit on any page have page -1, so they're never rendered
+        if page_numbers is None:
+            page_numbers = range(self.n_pages())
+        page_numbers = list(page_numbers)
+        index = { page: i for i, page in enumerate(page_numbers) }
         df = self.pack()
+        df = df[df.page.isin(page_numbers)]
         page_h, page_w = self.shape
-        page_image = np.zeros((page_h, page_w), dtype=np.uint8) + self.bg_color
-        sdf = df[df.page == page]
-        with self.bin:
-            if self.bin.schema == SCHEMA_VERSION_1:
-                ii = InfilledImages(self.bin)
-            else:
-                ii = self.bin.images
-            for index, row in sdf.iterrows():
-                y, x = row.y, row.x
-                h, w = row.h, row.w
-                unscaled_image = ii[row.roi_number]
-                scaled_image = resize(unscaled_image, (h, w), mode='reflect', preserve_range=True)
-                page_image[y:y+h, x:x+w] = scaled_image
-        return page_image
+        page_images = np.zeros((len(page_numbers), page_h, page_w), dtype=np.uint8) + self.bg_color
+        if len(df):
+            with self.bin:
+                start_bytes = self.bin.adc[self.bin.schema.START_BYTE]
+                df = df.assign(start_byte=start_bytes.loc[df.roi_number].values).sort_values('start_byte')
+                ii = self.images()
+                for row in df.itertuples():
+                    self.paste(page_images[index[row.page]], ii, row)
+        return list(page_images)
@@ -0,0 +1,116 @@
+import os
+import time
+import base64
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+
+# rendered mosaic pages, cached on disk and evicted least-recently-used when the cache exceeds its byte budget.
+# each page is stored as a PNG and as the base64 text the dashboard embeds, so either can be handed to nginx
+
+PAGE_FORMATS = {
+    'png': 'image/png',
+    'b64': 'text/plain',
+}
+
+PRUNE_LOCK_KEY = 'mosaic_page_cache_prune'
+# number of pages of a mosaic rendered in the background after its first page is requested
+PREFETCH_PAGES = 20
+# how long a background render of a mosaic's pages is assumed to be running, so it isn't queued twice
+PREFETCH_LOCK_TIMEOUT = 5 * 60
+
+# most often the cache directory is scanned for eviction
+PRUNE_INTERVAL = 60
+# eviction removes pages until the cache is this fraction of its budget, so it isn't pruned on every write
+PRUNE_TARGET = 0.9
+
+def page_path(pid, shape, scale, page, fmt):
+    # pages are spread over subdirectories so that no directory gets too large
+    h, w = shape
+    subdir = hashlib.sha1(pid.encode('utf8')).hexdigest()[:2]
+    filename = '{}_{}x{}_{}_{}.{}'.format(pid, h, w, int(round(scale * 100)), page, fmt)
+    return os.path.join(subdir, filename)
+
+def cached_page(pid, shape, scale, page, fmt):
+    # returns the path of a cached page relative to the cache directory, or None if it isn't cached
+    path = page_path(pid, shape, scale, page, fmt)
+    full_path = os.path.join(settings.MOSAIC_CACHE_DIR, path)
+    try:
+        os.utime(full_path) # record the access for LRU eviction
+    except FileNotFoundError:
+        return None
+    return path
+
+def write_atomic(path, data):
+    # write to a temporary file and rename it, so readers never see a partial page
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+    try:
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(data)
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def store_pages(pid, shape, scale, pages):
+    # cache pages, given a dict of PNG data keyed by page number
+    for page, png_data in pages.items():
+        for fmt, data in [('png', png_data), ('b64', base64.b64encode(png_data))]:
+            write_atomic(os.path.join(settings.MOSAIC_CACHE_DIR, page_path(pid, shape, scale, page, fmt)), data)
+    if cache.add(PRUNE_LOCK_KEY, True, timeout=PRUNE_INTERVAL): # this is atomic
+        prune_pages()
+
+def prefetch_lock_key(pid, shape, scale):
+    h, w = shape
+    return 'mosaic_prefetch_{}_{}x{}_{}'.format(pid, h, w, int(round(scale * 100)))
+
+def remove_pages(pid, shape, scale):
+    # remove every cached page of a mosaic, e.g. after its layout has been packed again
+    first_page = os.path.join(settings.MOSAIC_CACHE_DIR, page_path(pid, shape, scale, 0, 'png'))
+    subdir = os.path.dirname(first_page)
+    prefix = os.path.basename(first_page).rsplit('_', 1)[0] + '_'
+    try:
+        filenames = os.listdir(subdir)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        if filename.startswith(prefix):
+            try:
+                os.remove(os.path.join(subdir, filename))
+            except FileNotFoundError:
+                pass
+
+def prune_pages(budget=None):
+    # remove the least recently used pages until the cache is under its byte budget
+    if budget is None:
+        budget = settings.MOSAIC_CACHE_SIZE
+    entries = []
+    total = 0
+    for root, _, filenames in os.walk(settings.MOSAIC_CACHE_DIR):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            # abandoned temporary files are removed once they're old enough to not be in use
+            if filename.startswith('.') and st.st_mtime < time.time() - PRUNE_INTERVAL:
+                os.remove(path)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= budget:
+        return
+    entries.sort()
+    for _, size, path in entries:
+        if total <= budget * PRUNE_TARGET:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,45 @@
+import numpy as np
+
+from ifcb.data.adc import SCHEMA_VERSION_1
+
+# ROI geometry computed directly from ADC columns, without reading or stitching any images
+
+def roi_geometry(bin):
+    """returns the target numbers, widths, and heights of a bin's images as NumPy arrays.
+
+    for schema version 1 bins, ROIs split across two consecutive targets with the same trigger
+    are reported as a single stitched image under the first target number, with the dimensions
+    of the union of their bounding boxes, as InfilledImages does."""
+    adc = bin.adc
+    schema = bin.schema
+    target_numbers = adc.index.values.astype(np.int32)
+    widths = adc[schema.ROI_WIDTH].values.astype(np.int32)
+    heights = adc[schema.ROI_HEIGHT].values.astype(np.int32)
+    has_roi = (widths > 0) & (heights > 0)
+    if bin.schema != SCHEMA_VERSION_1 or len(target_numbers) < 2:
+        return target_numbers[has_roi], widths[has_roi], heights[has_roi]
+    xs = adc[schema.ROI_X].values.astype(np.int32)
+    ys = adc[schema.ROI_Y].values.astype(np.int32)
+    triggers = adc[schema.TRIGGER].values
+    # second[i] is True if target i is the second half of a pair starting at target i - 1.
+    # pairs do not overlap, so a target that completes a pair can't start another one: in a run
+    # of candidate pairs, targets are paired greedily from the start of the run
+    candidates = (triggers[1:] == triggers[:-1]) & has_roi[1:] & has_roi[:-1]
+    ix = np.arange(len(candidates))
+    run_start = np.maximum.accumulate(np.where(candidates & ~np.concatenate([[False], candidates[:-1]]), ix, 0))
+    pairs = candidates & ((ix - run_start) % 2 == 0)
+    second = np.concatenate([[False], pairs])
+    first = np.concatenate([pairs, [False]])
+    # union of the bounding boxes of each pair
+    a, b = np.nonzero(first)[0], np.nonzero(second)[0]
+    left = np.minimum(xs[a], xs[b])
+    bottom = np.minimum(ys[a], ys[b])
+    widths[a] = np.maximum(xs[a] + widths[a], xs[b] + widths[b]) - left
+    heights[a] = np.maximum(ys[a] + heights[a], ys[b] + heights[b]) - bottom
+    keep = has_roi & ~second
+    return target_numbers[keep], widths[keep], heights[keep]
+
+def count_rois(bin):
+    """returns the number of images in a bin, counting stitched pairs once"""
+    target_numbers, _, _ = roi_geometry(bin)
+    return len(target_numbers)
@@ -0,0 +1,87 @@
+from datetime import timedelta
+
+import pandas as pd
+
+from django.db import connection
+
+# per-dataset, per-instrument rollups of bin metrics at coarse time resolutions, so timelines don't have
+# to aggregate every bin. rollups are rebuilt from the bins table for the weeks affected by each change
+
+ROLLUP_RESOLUTIONS = ['hour', 'day', 'week']
+ROLLUP_METRICS = ['size', 'temperature', 'humidity', 'run_time', 'look_time', 'ml_analyzed',
+    'concentration', 'n_triggers', 'n_images']
+ROLLUP_AGGREGATES = ['sum', 'min', 'max']
+
+ROLLUP_TABLE = 'dashboard_timelinerollup'
+BIN_TABLE = 'dashboard_bin'
+BIN_DATASETS_TABLE = 'dashboard_bin_datasets'
+
+# changes to bins more than this far apart in time are rebuilt as separate ranges
+MAX_GAP = timedelta(days=7)
+
+def rollup_columns():
+    return ['{}_{}'.format(metric, aggregate) for metric in ROLLUP_METRICS for aggregate in ROLLUP_AGGREGATES]
+
+def truncate(ts, resolution):
+    # the start of the rollup bucket containing a time, as date_trunc computes it
+    ts = pd.to_datetime(ts, utc=True)
+    if resolution == 'hour':
+        return ts.floor('h')
+    day = ts.floor('D')
+    if resolution == 'day':
+        return day
+    return day - pd.Timedelta(days=day.weekday()) # weeks start on Monday
+
+def time_ranges(times):
+    # group times into [start, end) ranges of whole weeks that cover them
+    times = sorted(t for t in times if t is not None)
+    ranges = []
+    for t in times:
+        if ranges and t - ranges[-1][1] < MAX_GAP:
+            ranges[-1][1] = t
+        else:
+            ranges.append([t, t])
+    return [(truncate(start, 'week').to_pydatetime(), (truncate(end, 'week') + pd.Timedelta(days=7)).to_pydatetime())
+        for start, end in ranges]
+
+def rebuild_rollups(dataset_ids, start=None, end=None, conn=connection):
+    # recompute every rollup for the datasets in the time range [start, end), which should be whole weeks
+    dataset_ids = list(dataset_ids)
+    if not dataset_ids:
+        return
+    time_filter, params = '', []
+    if start is not None and end is not None:
+        time_filter = 'AND b.sample_time >= %s AND b.sample_time < %s'
+        params = [start, end]
+    columns = rollup_columns()
+    aggregates = ['{}(b.{})'.format(aggregate, metric) for metric in ROLLUP_METRICS for aggregate in ROLLUP_AGGREGATES]
+    with conn.cursor() as cursor:
+        for resolution in ROLLUP_RESOLUTIONS:
+            cursor.execute('DELETE FROM {} WHERE dataset_id = ANY(%s) AND resolution = %s {}'.format(
+                ROLLUP_TABLE, time_filter.replace('b.sample_time', 'start')), [dataset_ids, resolution] + params)
+            # resolution is one of ROLLUP_RESOLUTIONS, so it's safe to use as a literal
+            bucket = "date_trunc('{}', b.sample_time)".format(resolution)
+            cursor.execute('''INSERT INTO {} (dataset_id, instrument_id, resolution, start, count, {})
+                SELECT bd.dataset_id, b.instrument_id, %s, {}, COUNT(*), {}
+                FROM {} b JOIN {} bd ON bd.bin_id = b.id
+                WHERE NOT b.skip AND bd.dataset_id = ANY(%s) {}
+                GROUP BY bd.dataset_id, b.instrument_id, {}'''.format(
+                    ROLLUP_TABLE, ', '.join(columns), bucket, ', '.join(aggregates), BIN_TABLE, BIN_DATASETS_TABLE,
+                    time_filter, bucket),
+                [resolution, dataset_ids] + params)
+
+def update_rollups(dataset_ids, times):
+    # rebuild the rollups affected by changes to bins in the datasets with the given sample times
+    dataset_ids = list(dataset_ids)
+    for start, end in time_ranges(times):
+        rebuild_rollups(dataset_ids, start, end)
+
+def update_bin_rollups(bin_ids, times):
+    # rebuild the rollups affected by changes to bins, in every dataset they belong to
+    bin_ids = list(bin_ids)
+    if not bin_ids:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT DISTINCT dataset_id FROM {} WHERE bin_id = ANY(%s)'.format(BIN_DATASETS_TABLE), [bin_ids])
+        dataset_ids = [row[0] for row in cursor.fetchall()]
+    update_rollups(dataset_ids, times)
@@ -0,0 +1,87 @@
+import os
+import time
+
+import ifcb
+from ifcb.data.files import Fileset, FilesetBin
+
+# directories modified this close (in seconds) to the time they were last listed are listed again on the next
+# scan, in case files arrived within the resolution of the filesystem's modification times
+MTIME_SLACK = 2
+
+def is_fileset(filenames, basename):
+    """returns True if the .adc, .hdr, and .roi files for basename are all present and basename is a valid bin id"""
+    for ext in ['.adc', '.hdr', '.roi']:
+        if basename + ext not in filenames:
+            return False
+    try:
+        ifcb.Pid(basename).timestamp
+    except Exception:
+        return False
+    return True
+
+def child_directories(names, whitelist=[], blacklist=[]):
+    """filter subdirectory names using a data directory's whitelist and blacklist. if any of the names are
+    whitelisted, only those are searched"""
+    names = [n for n in names if n not in blacklist and not n.startswith('.')]
+    whitelisted = [n for n in names if n in whitelist]
+    if whitelisted:
+        return sorted(whitelisted)
+    return sorted(names)
+
+class IncrementalScan(object):
+    """walks a raw data directory, only listing files in subdirectories that have changed since the
+    previous scan.
+
+    the manifest records, for each subdirectory (relative to the root), its modification time and the names of its
+    subdirectories, so unchanged directories are neither listed nor searched for filesets; only their
+    subdirectories are checked. a new manifest is built as the scan proceeds and is available once the scan
+    is complete."""
+    def __init__(self, path, manifest=None, whitelist=[], blacklist=[]):
+        self.path = path
+        manifest = manifest or {}
+        self.previous_scan = manifest.get('scanned')
+        self.previous = manifest.get('dirs', {})
+        self.whitelist = whitelist
+        self.blacklist = blacklist
+        self.manifest = None
+    def changed(self, relpath, mtime_ns):
+        entry = self.previous.get(relpath)
+        if entry is None or entry[0] != mtime_ns:
+            return True
+        if self.previous_scan is None or mtime_ns / 1e9 >= self.previous_scan - MTIME_SLACK:
+            return True
+        return False
+    def __iter__(self):
+        scanned = time.time()
+        dirs = {}
+        yield from self._walk('', dirs)
+        # only record the new manifest once every directory has been walked
+        self.manifest = {
+            'scanned': scanned,
+            'dirs': dirs,
+        }
+    def _walk(self, relpath, dirs):
+        dirpath = os.path.join(self.path, relpath)
+        try:
+            mtime_ns = os.stat(dirpath).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if not self.changed(relpath, mtime_ns):
+            children = self.previous[relpath][1]
+            dirs[relpath] = [mtime_ns, children]
+        else:
+            subdirs, filenames = [], set()
+            with os.scandir(dirpath) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    else:
+                        filenames.add(entry.name)
+            children = child_directories(subdirs, self.whitelist, self.blacklist)
+            dirs[relpath] = [mtime_ns, children]
+            for filename in sorted(filenames):
+                basename, ext = os.path.splitext(filename)
+                if ext == '.adc' and is_fileset(filenames, basename):
+                    yield FilesetBin(Fileset(os.path.join(dirpath, basename)))
+        for child in children:
+            yield from self._walk(os.path.join(relpath, child), dirs)
@@ -0,0 +1,46 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .models import Bin, Dataset, Tag, TagEvent, Comment
+from .datacache import bump_data_version, bump_bin_data_version, bump_catalog_version
+
+# invalidate cached responses whenever bins, datasets, tags or comments are saved or deleted through the ORM,
+# including from the admin and management commands. bulk updates and inserts don't send these signals, so
+# code that uses them has to bump data versions itself
+
+# bin fields that no cached response depends on
+UNCACHED_BIN_FIELDS = set(['path', 'data_directory'])
+
+@receiver(post_save, sender=Bin)
+def bin_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created: # a new bin isn't in any dataset yet
+        return
+    if update_fields is not None and set(update_fields) <= UNCACHED_BIN_FIELDS:
+        return
+    bump_bin_data_version([instance.id])
+
+@receiver(post_delete, sender=Bin)
+def bin_deleted(sender, instance, **kwargs):
+    # the bin's dataset links are deleted before it is, so there's no telling which datasets it was in
+    bump_catalog_version()
+
+@receiver(m2m_changed, sender=Bin.datasets.through)
+def bin_datasets_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ['post_add', 'post_remove', 'post_clear']:
+        return
+    if reverse: # dataset.bins was changed
+        bump_data_version([instance.name])
+    elif pk_set is not None: # bin.datasets was changed
+        bump_data_version(Dataset.objects.filter(pk__in=pk_set).values_list('name', flat=True))
+    else: # bin.datasets was cleared
+        bump_catalog_version()
+
+@receiver([post_save, post_delete], sender=TagEvent)
+@receiver([post_save, post_delete], sender=Comment)
+def bin_annotation_changed(sender, instance, **kwargs):
+    bump_bin_data_version([instance.bin_id])
+
+@receiver([post_save, post_delete], sender=Dataset)
+@receiver([post_save, post_delete], sender=Tag)
+def catalog_changed(sender, instance, **kwargs):
+    bump_catalog_version()
@@ -1,3 +1,4 @@
+import os
 import time
 
 from celery import shared_task
@@ -6,45 +7,73 @@ from celery import signals
 import numpy as np
 import pandas as pd
 
+from django.conf import settings
 from django.core.cache import cache
 
-from .mosaic import Mosaic
+from .mosaic import DEFAULT_PACKER
+
+# number of rows of an uploaded metadata file to read at a time
+METADATA_CHUNK_SIZE = 10000
 
 @signals.worker_process_init.connect
 def precompile_bin_packer(sender, **kw):
-    print('precompiling bin packer', end='')
-    from .mosaic import pack
+    print('precompiling bin packers', end='')
+    from .mosaic import PACKERS, resize_area
     hs = np.array([10, 20, 30], dtype=np.int32)
     ws = np.array([30, 20, 10], dtype=np.int32)
     ids = np.array([0, 1, 2], dtype=np.int32)
     xs = np.zeros(3, dtype=np.int32)
     ys = np.zeros(3, dtype=np.int32)
-    pages = np.zeros(3, dtype=np.int32)
-    pack(100, 100, hs, ws, ys, xs, pages)
+    for pack in PACKERS.values():
+        pages = np.zeros(3, dtype=np.int32)
+        pack(100, 100, hs, ws, ys, xs, pages)
+    # ROIs are resized into slices of page images, which numba compiles separately from whole arrays
+    page_image = np.zeros((10, 10), dtype=np.uint8)
+    resize_area(np.zeros((4, 4), dtype=np.uint8), page_image[2:4, 2:4])
 
 @shared_task
-def mosaic_coordinates_task(bin_id, shape=(600,800), scale=0.33, cache_key=None):
+def mosaic_coordinates_task(bin_id, shape=(600,800), scale=0.33, cache_key=None, packer=DEFAULT_PACKER):
+    # packs the layout and stores it in the database and the cache. cache_key is no longer needed,
+    # since the bin computes it, but is kept for tasks already queued
     from dashboard.models import Bin
-    h, w = shape
     bin = Bin.objects.get(pid=bin_id)
-    b = bin._get_bin()
-    m = Mosaic(b, shape=shape, scale=scale)
     then = time.time()
-    coordinates = m.pack(max_pages=20)
+    coordinates = bin.build_mosaic_layout(shape, scale, packer)
     elapsed = time.time() - then
     print('computing mosaic coordinates for {} took {}s'.format(bin.pid, elapsed), end='')
-    result = coordinates.to_dict('list')
-    if cache_key is not None:
-        cache.set(cache_key, result)
-    return result
+    return coordinates.to_dict('list')
+
+@shared_task
+def mosaic_pages_task(bin_id, shape, scale, lock_key):
+    # render the first pages of a mosaic that aren't cached yet, in one pass over the bin's ROIs, and cache them
+    from dashboard.models import Bin
+    from ifcb.data.imageio import format_image
+    from .pagecache import PREFETCH_PAGES, cached_page, store_pages
+    shape = tuple(shape)
+    try:
+        bin = Bin.objects.get(pid=bin_id)
+        coordinates = bin.mosaic_coordinates(shape, scale)
+        n_pages = int(coordinates.page.max()) + 1 if len(coordinates) else 0
+        page_numbers = [page for page in range(min(n_pages, PREFETCH_PAGES))
+            if cached_page(bin_id, shape, scale, page, 'png') is None]
+        if not page_numbers:
+            return
+        pages, _ = bin.mosaic_pages(page_numbers, shape=shape, scale=scale)
+        store_pages(bin_id, shape, scale, { page: format_image(arr, 'image/png').getvalue()
+            for page, arr in zip(page_numbers, pages) })
+    finally:
+        cache.delete(lock_key)
 
 @shared_task(bind=True)
-def sync_dataset(self, dataset_id, lock_key, cancel_key, newest_only=True):
+def sync_dataset(self, dataset_id, lock_key, cancel_key, newest_only=True, workers=None, incremental=False,
+                 resume=True):
     from dashboard.models import Dataset
     from dashboard.accession import Accession
     ds = Dataset.objects.get(id=dataset_id)
     print('syncing dataset {}'.format(ds.name))
-    acc = Accession(ds, newest_only=newest_only)
+    if workers is None:
+        workers = settings.ACCESSION_WORKERS
+    acc = Accession(ds, newest_only=newest_only, workers=workers, incremental=incremental, resume=resume)
     def progress_callback(p):
         self.update_state(state='PROGRESS', meta=p)
         cancel = cache.get(cancel_key)
@@ -60,9 +89,35 @@ def sync_dataset(self, dataset_id, lock_key, cancel_key, newest_only=True):
     return result
 
 @shared_task(bind=True)
-def import_metadata(self, json_dataframe, lock_key, cancel_key):
+def sync_bins(self, dataset_id, pids):
+    from dashboard.models import Dataset, Bin
+    from dashboard.accession import Accession
+    ds = Dataset.objects.get(id=dataset_id)
+    existing = set(Bin.objects.filter(pid__in=pids).values_list('pid', flat=True))
+    pids = [pid for pid in pids if pid not in existing]
+    print('syncing {} bins to dataset {}'.format(len(pids), ds.name))
+    acc = Accession(ds, workers=settings.ACCESSION_WORKERS)
+    bin_dds, not_found = acc.resolve(pids)
+    def progress_callback(p):
+        self.update_state(state='PROGRESS', meta=p)
+        return True
+    result = acc.sync(progress_callback=progress_callback, bin_dds=bin_dds)
+    result['not_found'] = not_found
+    return result
+
+@shared_task(bind=True)
+def export_table(self, key, kind, fmt, query, lock_key):
+    from dashboard.export import write_export
+    def progress_callback(p):
+        self.update_state(state='PROGRESS', meta=p)
+    try:
+        return write_export(key, kind, fmt, query, progress_callback)
+    finally:
+        cache.delete(lock_key)
+
+@shared_task(bind=True)
+def import_metadata(self, path, lock_key, cancel_key, team_ids=None):
     from dashboard.accession import import_metadata
-    df = pd.read_json(json_dataframe)
     def progress_callback(p):
         self.update_state(state='PROGRESS', meta=p)
         cancel = cache.get(cancel_key)
@@ -71,10 +126,14 @@ def import_metadata(self, json_dataframe, lock_key, cancel_key):
         return True
     result = None
     try:
-        result = import_metadata(df, progress_callback=progress_callback)
+        # read the uploaded file a chunk at a time
+        with pd.read_csv(path, chunksize=METADATA_CHUNK_SIZE) as chunks:
+            result = import_metadata(chunks, progress_callback=progress_callback, team_ids=team_ids)
     except:
         self.update_state(state='ERROR', meta={})
     finally:
+        if os.path.exists(path):
+            os.remove(path)
         cache.delete(cancel_key)
         cache.delete(lock_key)
     return result
@@ -0,0 +1,49 @@
+from django.db import connection
+
+# Mapbox Vector Tiles of bin locations, so that map payloads depend on the viewport and zoom rather than on
+# the number of bins. bins whose locations fall in the same cell of a grid over each tile are clustered into
+# a single feature with a count
+
+TILE_LAYER = 'bins'
+# tile coordinate space, as used by ST_AsMVTGeom
+TILE_EXTENT = 4096
+# size of the clustering grid cells, in tile coordinates. 16 is 256 cells across a tile, about one per pixel
+CLUSTER_CELL_SIZE = 16
+# at and above this zoom level, bins are not clustered unless they're at exactly the same location
+MAX_CLUSTER_ZOOM = 14
+
+def valid_tile(z, x, y):
+    return 0 <= z <= 30 and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+def bin_tile(bin_qs, z, x, y):
+    """returns a Mapbox Vector Tile, as bytes, of the located bins in a queryset. each feature has the pid and
+    sample time (epoch seconds) of the earliest bin at that point, and the number of bins clustered there"""
+    bins_sql, bins_params = bin_qs.values('id').query.sql_with_params()
+    cell_size = CLUSTER_CELL_SIZE if z < MAX_CLUSTER_ZOOM else 1
+    sql = '''
+        WITH bounds AS (
+            SELECT ST_TileEnvelope(%s, %s, %s) AS geom
+        ),
+        points AS (
+            SELECT ST_SnapToGrid(ST_AsMVTGeom(ST_Transform(b.location, 3857), bounds.geom, %s, 0, false), %s) AS geom,
+                b.pid, b.sample_time
+            FROM dashboard_bin b, bounds
+            WHERE b.location IS NOT NULL
+            AND b.location && ST_Transform(bounds.geom, 4326)
+            AND b.id IN ({})
+        ),
+        clusters AS (
+            SELECT geom, COUNT(*) AS count,
+                (array_agg(pid ORDER BY sample_time, pid))[1] AS pid,
+                EXTRACT(EPOCH FROM MIN(sample_time))::bigint AS sample_time
+            FROM points
+            WHERE geom IS NOT NULL
+            GROUP BY geom
+        )
+        SELECT ST_AsMVT(clusters.*, %s, %s, 'geom') FROM clusters
+    '''.format(bins_sql)
+    params = [z, x, y, TILE_EXTENT, cell_size] + list(bins_params) + [TILE_LAYER, TILE_EXTENT]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        tile = cursor.fetchone()[0]
+    return bytes(tile) if tile is not None else b''
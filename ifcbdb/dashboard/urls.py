@@ -115,11 +115,13 @@ urlpatterns = [
     ##################################
     # Paths used for API/Ajax requests
     ##################################
+    path('api/time-series', views.generate_multi_time_series, name='generate_multi_time_series'),
     path('api/time-series/<slug:metric>', views.generate_time_series, name='generate_time_series'),
     path('api/bin/<slug:bin_id>', views.bin_data, name='bin_data'),
     path('api/bin/<slug:bin_id>', views.bin_data),
     path('api/closest_bin', views.closest_bin, name='closest_bin'),  # closest bin in time
     path('api/nearest_bin', views.nearest_bin, name='nearest_bin'),
+    path('api/map/tiles/<int:z>/<int:x>/<int:y>.mvt', views.map_tile, name='map_tile'),
     path('api/most_recent_bin', views.most_recent_bin, name='most_recent_bin'),
     path('api/mosaic/coordinates/<slug:bin_id>', views.mosaic_coordinates, name='mosaic_coordintes'),
     path('api/mosaic/encoded_image/<slug:bin_id>', views.mosaic_page_encoded_image, name='mosaic_page_encoded_image'),
@@ -148,6 +150,11 @@ urlpatterns = [
 
     path('api/export_metadata/<slug:dataset_name>', views.export_metadata_view, name='export_metadata'),
     path('api/export_metadata/', views.export_metadata_view, name='export_metadata'),
+    path('api/export/<slug:kind>', views.export_table_view, name='export_table'),
+    path('api/export/status/<slug:key>', views.export_table_status, name='export_table_status'),
+    path('api/export/download/<slug:key>', views.export_table_download, name='export_table_download'),
     path('api/sync_bin', views.sync_bin, name='sync_bin'),
+    path('api/sync_bins', views.sync_bins, name='sync_bins'),
+    path('api/sync_bins/status/<str:task_id>', views.sync_bins_status, name='sync_bins_status'),
     path('api/extent', views.extent, name='extent'),
  ]
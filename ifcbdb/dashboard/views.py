@@ -1,4 +1,6 @@
+import base64
 import json
+import os
 import re
 from io import BytesIO
 
@@ -16,6 +18,7 @@ from django.http import \
     HttpResponseRedirect, HttpResponseNotFound, StreamingHttpResponse
 from django.views.decorators.cache import cache_control
 from django.views.decorators.http import require_POST
+from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
 from django.contrib.gis.db.models import Extent
 
@@ -25,11 +28,16 @@ from celery.result import AsyncResult
 from ifcb.data.imageio import format_image
 from ifcb.data.adc import schema_names
 
-from .models import Dataset, Bin, Instrument, Timeline, bin_query, Tag, Comment, normalize_tag_name, Team, TeamDataset
+from .models import Dataset, Bin, Instrument, Timeline, TimelineRollup, bin_query, Tag, Comment, normalize_tag_name, Team, TeamDataset
 from .forms import DatasetSearchForm
+from .roi import roi_geometry
+from .datacache import cached_response
+from .tiles import bin_tile, valid_tile
+from .pagecache import PAGE_FORMATS, PREFETCH_LOCK_TIMEOUT, cached_page, store_pages, prefetch_lock_key
+from .export import EXPORT_KINDS, EXPORT_FORMATS, export_key, export_task_key, export_bins, cached_export
 from common.utilities import *
 
-from dashboard.accession import Accession, export_metadata
+from dashboard.accession import Accession, export_metadata_csv
 import waffle
 
 def index(request):
@@ -111,15 +119,13 @@ def search_timeline_locations(request):
     start_date = request.POST.get("start_date")
     end_date = request.POST.get("end_date")
 
-    # Replace spaces with forward slashes in the dataset name or the cache key will not be valid. We're using a
-    #   character that is not a legal character within a dataset name
-    clean_dataset_name = dataset_name.replace(" ", "/") if dataset_name else ""
+    params = filter_parameters(request.POST)
+    params['bin'] = bin_id
 
-    cache_key = 'tloc_b={};d={};t={};i={};c={};st={}'.format(bin_id, clean_dataset_name, tags, instrument_number, cruise, sample_type)
-    cached = cache.get(cache_key)
-    if cached is not None:
-        return JsonResponse(cached)
+    return JsonResponse(cached_response('timeline_locations', params,
+        lambda: timeline_locations_data(bin_id, dataset_name, tags, instrument_number, cruise, sample_type)))
 
+def timeline_locations_data(bin_id, dataset_name, tags, instrument_number, cruise, sample_type):
     if not dataset_name and not tags and instrument_number is None and cruise is None:
         qs = Bin.objects.filter(pid=bin_id)
     else:
@@ -152,18 +158,21 @@ def search_timeline_locations(request):
 
     dataset_locations = [[d.name + "|" + d.title, d.latitude, d.longitude, "d"] for d in datasets]
 
-    result = {
+    return {
         "locations": bin_locations + dataset_locations
     }
-    try:
-        cache.set(cache_key, result)
-    except Exception as e: # value is probably too large
-        try:
-            cache.delete(cache_key)
-        except Exception as e:
-            pass
 
-    return JsonResponse(result)
+
+def map_tile(request, z, x, y):
+    # vector tile of the locations of bins matching the filter parameters
+    if not valid_tile(z, x, y):
+        raise Http404("no such tile")
+
+    params = filter_parameters(request.GET)
+    params['tile'] = [z, x, y]
+    tile = cached_response('map_tile', params, lambda: bin_tile(filter_parameters_bin_query(request.GET), z, x, y))
+
+    return HttpResponse(tile, content_type='application/vnd.mapbox-vector-tile')
 
 
 @require_POST
@@ -228,6 +237,17 @@ def request_get_sample_type(sample_type_string):
     if sample_type_string:
         return sample_type_string
 
+def filter_parameters(method):
+    # normalized filter parameters, for cache keys
+    tags = request_get_tags(method.get('tags'))
+    return {
+        'dataset': method.get('dataset') or None,
+        'tags': sorted(tags) if tags else None,
+        'instrument': request_get_instrument(method.get('instrument')),
+        'cruise': request_get_cruise(method.get('cruise')),
+        'sample_type': request_get_sample_type(method.get('sample_type')),
+    }
+
 # FIXME add start and end?
 def filter_parameters_bin_query(method):
     dataset_name = method.get('dataset')
@@ -242,6 +262,13 @@ def filter_parameters_bin_query(method):
 
     return bin_qs
 
+def filter_parameters_rollups(method):
+    # timeline rollups equivalent to filter_parameters_bin_query, if the filters allow using them
+    if request_get_tags(method.get('tags')) or request_get_cruise(method.get('cruise')) \
+            or request_get_sample_type(method.get('sample_type')):
+        return None
+    return TimelineRollup.query(method.get('dataset'), request_get_instrument(method.get('instrument')))
+
 def timeline_page(request, team_name=None):
     bin_id = request.GET.get("bin")
     dataset_name = request.GET.get("dataset")
@@ -588,18 +615,43 @@ def mosaic_coordinates(request, bin_id):
 @cache_control(max_age=31557600) # client cache for 1y
 @require_POST
 def mosaic_page_image(request, bin_id):
-    arr = _mosaic_page_image(request, bin_id)
-    image_data = format_image(arr, 'image/png')
-
-    return HttpResponse(image_data, content_type='image/png')
+    return _mosaic_page_response(request, bin_id, 'png')
 
 
 @cache_control(max_age=31557600) # client cache for 1y
 @require_POST
 def mosaic_page_encoded_image(request, bin_id):
-    arr = _mosaic_page_image(request, bin_id)
-
-    return HttpResponse(embed_image(arr), content_type='plain/text')
+    return _mosaic_page_response(request, bin_id, 'b64')
+
+
+def _mosaic_page_response(request, bin_id, fmt):
+    # serve a mosaic page from the page cache, rendering and caching it first if needed
+    if request.GET.get("view_size", Bin.MOSAIC_DEFAULT_VIEW_SIZE) not in Bin.MOSAIC_VIEW_SIZES:
+        return HttpResponseBadRequest('view_size must be one of {}'.format(', '.join(Bin.MOSAIC_VIEW_SIZES)))
+    shape, scale, page = _mosaic_page_parameters(request)
+    path = cached_page(bin_id, shape, scale, page, fmt)
+    if path is None:
+        # render only the requested page, and render the next ones in the background since they're
+        # likely to be requested next
+        arr, coordinates = _mosaic_page(bin_id, shape, scale, page)
+        n_pages = int(coordinates.page.max()) + 1 if len(coordinates) else 1
+        if page < 0 or page >= n_pages:
+            raise Http404('no such page')
+        store_pages(bin_id, shape, scale, { page: format_image(arr, 'image/png').getvalue() })
+        lock_key = prefetch_lock_key(bin_id, shape, scale)
+        if cache.add(lock_key, True, timeout=PREFETCH_LOCK_TIMEOUT): # this is atomic
+            from dashboard.tasks import mosaic_pages_task
+            mosaic_pages_task.delay(bin_id, shape, scale, lock_key)
+        path = cached_page(bin_id, shape, scale, page, fmt)
+        if path is None: # evicted already
+            return HttpResponse(embed_image(arr) if fmt == 'b64' else format_image(arr, 'image/png'),
+                content_type=PAGE_FORMATS[fmt])
+    if settings.MOSAIC_CACHE_X_ACCEL:
+        # nginx serves the file from an internal location
+        response = HttpResponse(content_type=PAGE_FORMATS[fmt])
+        response['X-Accel-Redirect'] = settings.MOSAIC_CACHE_URL + path
+        return response
+    return FileResponse(open(os.path.join(settings.MOSAIC_CACHE_DIR, path), 'rb'), content_type=PAGE_FORMATS[fmt])
 
 
 def _image_data(bin_id, target, mimetype):
@@ -666,19 +718,13 @@ def legacy_roisizes(request, dataset_name, bin_id):
     b = get_object_or_404(Bin, pid=bin_id)
     bin_in_dataset_or_404(b, dataset_name)
     fq_ts_url = fully_qualified_timeseries_url(request, dataset_name)
-    ii = b.images()
-    tns, pids, widths, heights = [], [], [], []
-    for target_number in ii:
-        tns.append(target_number)
-        fq_pid = '{}/{}_{:05d}'.format(fq_ts_url, bin_id, target_number)
-        width, height = ii.shape(target_number)
-        pids.append(fq_pid)
-        widths.append(int(width))
-        heights.append(int(height))
+    tns, ws, hs = roi_geometry(b._get_bin())
+    pids = ['{}/{}_{:05d}'.format(fq_ts_url, bin_id, tn) for tn in tns]
+    # the legacy response has always reported (height, width) as (width, height)
     return JsonResponse({
-        'targetNumber': tns,
-        'width': widths,
-        'height': heights,
+        'targetNumber': tns.tolist(),
+        'width': hs.tolist(),
+        'height': ws.tolist(),
         'pid': pids
         })
 
@@ -847,8 +893,7 @@ def _bin_details(bin, dataset=None, view_size=None, scale_factor=None, preload_a
             dataset_name = None
         bin_qs = bin_query(dataset_name=dataset_name, instrument_number=instrument_number,
             tags=tags, cruise=cruise, sample_type=sample_type)
-        previous_bin = Timeline(bin_qs).previous_bin(bin)
-        next_bin = Timeline(bin_qs).next_bin(bin)
+        previous_bin, next_bin = Timeline(bin_qs).adjacent_bins(bin)
 
     if preload_adjacent_bins and include_coordinates:
         if previous_bin is not None:
@@ -895,22 +940,20 @@ def _bin_details(bin, dataset=None, view_size=None, scale_factor=None, preload_a
         "niskin": bin.niskin,
     }
 
-def _mosaic_page_image(request, bin_id):
+def _mosaic_page_parameters(request):
     view_size = request.GET.get("view_size", Bin.MOSAIC_DEFAULT_VIEW_SIZE)
     scale_factor = int(request.GET.get("scale_factor", Bin.MOSAIC_DEFAULT_SCALE_FACTOR))
     page = int(request.GET.get("page", 0))
 
+    return parse_view_size(view_size), parse_scale_factor(scale_factor), page
+
+def _mosaic_page(bin_id, shape, scale, page):
     bin = get_object_or_404(Bin, pid=bin_id)
-    shape = parse_view_size(view_size)
-    scale = parse_scale_factor(scale_factor)
     try:
-        arr, _ = bin.mosaic(page=page, shape=shape, scale=scale)
+        return bin.mosaic(page=page, shape=shape, scale=scale)
     except KeyError: # raw data not found
-        #return np.array([[0]], dtype='uint8')
         raise Http404('raw data not found')
 
-    return arr
-
 # TODO: The below views are API/AJAX calls; in the future, it would be beneficial to use a proper API framework
 # TODO: The logic to flow through to a finer resolution if the higher ones only return one data item works, but
 #   it causes the UI to need to download data on each zoom level when scroll up, only to then ignore the data. Updates
@@ -929,10 +972,34 @@ def generate_time_series(request, metric,):
     # Allows us to keep consistent url names
     metric = metric.replace("-", "_")
 
-    bin_qs = filter_parameters_bin_query(request.GET)
+    # optional target number of points for bin resolution time series, and how to downsample to it
+    try:
+        max_points = int(request.GET.get("max_points"))
+    except (TypeError, ValueError):
+        max_points = None
+    downsample = DOWNSAMPLE_METHODS.get(request.GET.get("downsample", "lttb"))
+    if downsample is None:
+        return HttpResponseBadRequest("unsupported downsampling method")
+
+    params = filter_parameters(request.GET)
+    params.update({
+        'metric': metric,
+        'resolution': resolution,
+        'start': start,
+        'end': end,
+        'max_points': max_points,
+        'downsample': request.GET.get("downsample", "lttb"),
+    })
+
+    return JsonResponse(cached_response('time_series', params,
+        lambda: time_series_data(request.GET, metric, start, end, resolution, max_points, downsample)))
+
+def time_series_data(method, metric, start, end, resolution, max_points, downsample):
+    bin_qs = filter_parameters_bin_query(method)
+    rollups = filter_parameters_rollups(method)
 
     def query_timeline(metric, start, end, resolution):
-        time_series, resolution = Timeline(bin_qs).metrics(metric, start, end, resolution=resolution)
+        time_series, resolution = Timeline(bin_qs, rollups=rollups).metrics(metric, start, end, resolution=resolution)
 
         time_data = [item["dt"] for item in time_series]
         metric_data = []
@@ -949,6 +1016,12 @@ def generate_time_series(request, metric,):
 
         return time_series, resolution, time_data, metric_data
 
+    def downsample_timeline(time_data, metric_data):
+        # reduce a bin resolution time series to at most max_points, preserving its shape
+        x = pd.to_datetime(time_data, utc=True).asi8
+        keep = downsample(x, np.array(metric_data, dtype=np.float64), max_points)
+        return [time_data[i] for i in keep], [metric_data[i] for i in keep]
+
     if start is not None:
         time_start = start
     if end is not None:
@@ -966,7 +1039,13 @@ def generate_time_series(request, metric,):
         time_start = min(time_data)
         time_end = max(time_data)
 
-    return JsonResponse({
+    n_points = len(time_data)
+    decimated = False
+    if resolution == 'bin' and max_points is not None and n_points > max_points:
+        time_data, metric_data = downsample_timeline(time_data, metric_data)
+        decimated = True
+
+    return {
         "x": time_data,
         "x-range": {
             "start": time_start,
@@ -975,7 +1054,88 @@ def generate_time_series(request, metric,):
         "y": metric_data,
         "y-axis": Timeline.metric_label(metric),
         "resolution": resolution,
+        "decimated": decimated,
+        "points": n_points,
+    }
+
+TIME_SERIES_ENCODINGS = ['json', 'base64', 'binary']
+
+def generate_multi_time_series(request):
+    # several metrics aggregated in one pass. times are epoch milliseconds and values are float32, with
+    # missing and negative values reported as 0 as in generate_time_series. with encoding=base64 the arrays
+    # are base64 encoded little-endian int64/float32, and with encoding=binary the response body is the
+    # time array followed by each metric's array in the order requested
+    metrics = [m.replace("-", "_") for m in request.GET.get("metrics", "").split(",") if m]
+    if not metrics:
+        return HttpResponseBadRequest("metrics required")
+    for metric in metrics:
+        if metric not in Timeline.TIMELINE_METRICS:
+            return HttpResponseBadRequest("unsupported metric {}".format(metric))
+    resolution = request.GET.get("resolution", "auto")
+    if resolution not in Timeline.RESOLUTIONS:
+        return HttpResponseBadRequest("unsupported time resolution {}".format(resolution))
+    encoding = request.GET.get("encoding", "json")
+    if encoding not in TIME_SERIES_ENCODINGS:
+        return HttpResponseBadRequest("unsupported encoding {}".format(encoding))
+    start = request.GET.get("start")
+    end = request.GET.get("end")
+    if start is not None:
+        start = pd.to_datetime(start, utc=True)
+    if end is not None:
+        end = pd.to_datetime(end, utc=True)
+
+    params = filter_parameters(request.GET)
+    params.update({
+        'metrics': metrics,
+        'resolution': resolution,
+        'start': start,
+        'end': end,
     })
+    data = cached_response('multi_time_series', params,
+        lambda: multi_time_series_data(request.GET, metrics, start, end, resolution))
+
+    if encoding == 'binary':
+        body = data['x'].astype('<i8').tobytes() + b''.join(data['y'][m].astype('<f4').tobytes() for m in metrics)
+        response = HttpResponse(body, content_type='application/octet-stream')
+        response['X-Resolution'] = data['resolution']
+        response['X-Count'] = len(data['x'])
+        response['X-Metrics'] = ','.join(metrics)
+        return response
+
+    if encoding == 'base64':
+        encode = lambda a, dtype: base64.b64encode(a.astype(dtype).tobytes()).decode('ascii')
+        x = encode(data['x'], '<i8')
+        y = { m: encode(data['y'][m], '<f4') for m in metrics }
+    else:
+        x = data['x'].tolist()
+        y = { m: data['y'][m].tolist() for m in metrics }
+
+    return JsonResponse({
+        "count": len(data['x']),
+        "x": x,
+        "y": y,
+        "y-axis": { m: Timeline.metric_label(m) for m in metrics },
+        "resolution": data['resolution'],
+    })
+
+def multi_time_series_data(method, metrics, start, end, resolution):
+    bin_qs = filter_parameters_bin_query(method)
+    rollups = filter_parameters_rollups(method)
+
+    records, resolution = Timeline(bin_qs, rollups=rollups).multi_metrics(metrics, start, end, resolution=resolution)
+
+    df = pd.DataFrame.from_records(records, columns=['dt'] + metrics)
+    x = pd.to_datetime(df['dt'], utc=True).astype('int64').values // 1000000
+    y = {}
+    for m in metrics:
+        values = pd.to_numeric(df[m], errors='coerce').fillna(0).values.astype(np.float32)
+        y[m] = np.maximum(values, 0)
+
+    return {
+        "x": x,
+        "y": y,
+        "resolution": resolution,
+    }
 
 
 # TODO: This is also where page caching could occur...
@@ -1029,6 +1189,9 @@ def closest_bin(request):
     })
 
 
+# most bins nearest_bin will return
+MAX_NEAREST_BINS = 100
+
 def nearest_bin(request):
     bins = filter_parameters_bin_query(request.POST)
     start = request.POST.get('start')  # limit to start time
@@ -1038,15 +1201,25 @@ def nearest_bin(request):
     lon = request.POST.get('longitude')
     if lat is None or lon is None:
         return HttpResponseBadRequest('lat/lon required')
-    if tags is None:
-        tags = []
-    else:
-        tags = ','.split(tags)
-    lon = float(lon)
-    lat = float(lat)
-    bin_id = Timeline(bins).nearest_bin(lon, lat).pid
+    try:
+        lon = float(lon)
+        lat = float(lat)
+        k = int(request.POST.get('k', 1))
+    except ValueError:
+        return HttpResponseBadRequest('invalid lat/lon or k')
+    if k < 1 or k > MAX_NEAREST_BINS:
+        return HttpResponseBadRequest('k must be between 1 and {}'.format(MAX_NEAREST_BINS))
+    bins = Timeline(bins).time_range(start or None, end or None)
+    nearest = Timeline(bins, filter_skip=False).nearest_bins(lon, lat, k)
     return JsonResponse({
-        'bin_id': bin_id
+        'bin_id': nearest[0].pid if nearest else '',
+        'bins': [{
+            'pid': b.pid,
+            'distance': b.distance.m,
+            'sample_time': b.sample_time,
+            'lat': b.latitude,
+            'lng': b.longitude,
+        } for b in nearest],
     })
 
 def most_recent_bin(request):
@@ -1182,11 +1355,15 @@ def bin_location(request):
 
 
 def filter_options(request):
-    dataset_name = request.GET.get("dataset")
-    tags = request_get_tags(request.GET.get("tags"))
-    instrument_number = request_get_instrument(request.GET.get("instrument"))
-    cruise = request_get_cruise(request.GET.get("cruise"))
-    sample_type = request_get_sample_type(request.GET.get('sample_type'))
+    return JsonResponse(cached_response('filter_options', filter_parameters(request.GET),
+        lambda: filter_options_data(request.GET)))
+
+def filter_options_data(method):
+    dataset_name = method.get("dataset")
+    tags = request_get_tags(method.get("tags"))
+    instrument_number = request_get_instrument(method.get("instrument"))
+    cruise = request_get_cruise(method.get("cruise"))
+    sample_type = request_get_sample_type(method.get('sample_type'))
 
     if dataset_name:
         ds = Dataset.objects.get(name=dataset_name)
@@ -1212,13 +1389,13 @@ def filter_options(request):
     bq = bin_query(dataset_name=dataset_name, tags=tags, cruise=cruise, instrument_number=instrument_number)
     sample_type_options = [c['sample_type'] for c in bq.exclude(sample_type='').values('sample_type').order_by('sample_type').distinct()]
 
-    return JsonResponse({
+    return {
         "instrument_options": instruments_options,
         "dataset_options": datasets_options,
         "tag_options": tag_options,
         "cruise_options": cruise_options,
         'sample_type_options': sample_type_options,
-        })
+        }
 
 def has_products(request, bin_id):
     b = get_object_or_404(Bin, pid=bin_id)
@@ -1275,15 +1452,19 @@ def tags(request):
     return JsonResponse({'cloud': list(cloud)})
 
 def timeline_info(request):
-    bin_qs = filter_parameters_bin_query(request.GET)
+    return JsonResponse(cached_response('timeline_info', filter_parameters(request.GET),
+        lambda: timeline_info_data(request.GET)))
+
+def timeline_info_data(method):
+    bin_qs = filter_parameters_bin_query(method)
 
     timeline = Timeline(bin_qs)
 
-    return JsonResponse({
+    return {
         'n_bins': len(timeline),
         'total_data_volume': timeline.total_data_volume(),
         'n_images': timeline.n_images(),
-        })
+        }
 
 def list_images(request, pid):
     b = get_object_or_404(Bin, pid=pid)
@@ -1333,18 +1514,88 @@ def export_metadata_view(request, dataset_name=None):
         end_date = pd.to_datetime(end_date, utc=True) + pd.Timedelta('1d')
         bin_qs = bin_qs.filter(sample_time__lte=end_date)
 
-    if bin_qs.count() == 0:
+    if not bin_qs.exists():
         raise Http404('no bins match the given query')
 
     ds = Dataset.objects.get(name=dataset_name) if dataset_name else None
-    df = export_metadata(ds, bin_qs)
 
     filename = (dataset_name or 'ifcb-metadata') + '.csv'
-    response = dataframe_csv_response(df, index=None)
+    response = StreamingHttpResponse(export_metadata_csv(ds, bin_qs), content_type='text/csv')
     response['Content-Disposition'] = f'attachment; filename={filename}'
 
     return response
 
+def export_table_state(request, key):
+    # report on a columnar export, with a download URL once it's ready
+    entry = cached_export(key)
+    if entry is not None:
+        return {
+            'state': 'SUCCESS',
+            'url': request.build_absolute_uri(reverse('export_table_download', args=[key])),
+        }
+    task_id = cache.get(export_task_key(key))
+    if task_id is None:
+        return None
+    result = AsyncResult(task_id)
+    info = result.info
+    if isinstance(info, Exception):
+        info = str(info)
+    return {
+        'state': result.state,
+        'info': info,
+        'status_url': request.build_absolute_uri(reverse('export_table_status', args=[key])),
+    }
+
+def export_table_view(request, kind):
+    # start a columnar export of bins (the same table as export_metadata) or of their ROIs,
+    # unless it's already cached or in progress
+    from dashboard.tasks import export_table
+    fmt = request.GET.get('format', 'parquet')
+    if kind not in EXPORT_KINDS:
+        raise Http404('unknown export {}'.format(kind))
+    if fmt not in EXPORT_FORMATS:
+        return HttpResponseBadRequest('unsupported format {}'.format(fmt))
+    include_skip = request.GET.get('include_skip', 'true')
+    query = {
+        'dataset_name': request.GET.get('dataset'),
+        'tags': request_get_tags(request.GET.get('tags')),
+        'instrument_number': request_get_instrument(request.GET.get('instrument')),
+        'cruise': request_get_cruise(request.GET.get('cruise')),
+        'sample_type': request_get_sample_type(request.GET.get('sample_type')),
+        'filter_skip': not include_skip.lower() == 'true',
+        'start_date': request.GET.get('start_date'),
+        'end_date': request.GET.get('end_date'),
+    }
+    key = export_key(kind, fmt, query)
+    state = export_table_state(request, key)
+    if state is not None and state['state'] not in ['FAILURE', 'REVOKED']:
+        return JsonResponse(state)
+    if not export_bins(query).exists():
+        raise Http404('no bins match the given query')
+    lock_key = '{}_lock'.format(key)
+    if cache.add(lock_key, True, timeout=settings.EXPORT_CACHE_TIMEOUT): # this is atomic
+        r = export_table.delay(key, kind, fmt, query, lock_key)
+        cache.set(export_task_key(key), r.task_id, timeout=settings.EXPORT_CACHE_TIMEOUT)
+    return JsonResponse(export_table_state(request, key) or {
+        'state': 'PENDING',
+        'status_url': request.build_absolute_uri(reverse('export_table_status', args=[key])),
+    })
+
+def export_table_status(request, key):
+    state = export_table_state(request, key)
+    if state is None:
+        raise Http404('no such export')
+    return JsonResponse(state)
+
+def export_table_download(request, key):
+    entry = cached_export(key)
+    if entry is None:
+        raise Http404('export not found or expired')
+    _, extension = os.path.splitext(entry['path'])
+    content_type = [ct for ext, ct in EXPORT_FORMATS.values() if ext == extension][0]
+    return FileResponse(open(entry['path'], 'rb'), as_attachment=True, filename=entry['filename'],
+        content_type=content_type)
+
 def sync_bin(request):
     dataset_name = request.GET.get("dataset")
     bin_id = request.GET.get('bin')
@@ -1359,6 +1610,41 @@ def sync_bin(request):
     acc.sync_one(bin_id)
     return JsonResponse({'result':'synced'})
 
+# most bins that can be queued by one sync request
+MAX_SYNC_BINS = 1000
+
+@csrf_exempt
+@require_POST
+def sync_bins(request):
+    # queue a list of bins for accession in the background. bin ids can be given as
+    # repeated "bin" parameters or as a comma-separated "bins" parameter
+    from dashboard.tasks import sync_bins
+    dataset = get_object_or_404(Dataset, name=request.POST.get('dataset'))
+    pids = request.POST.getlist('bin')
+    if request.POST.get('bins'):
+        pids.extend(re.split(',', request.POST.get('bins')))
+    pids = [pid.strip() for pid in pids if pid.strip()]
+    if not pids:
+        return HttpResponseBadRequest('no bins specified')
+    if len(pids) > MAX_SYNC_BINS:
+        return HttpResponseBadRequest('at most {} bins can be synced per request'.format(MAX_SYNC_BINS))
+    r = sync_bins.delay(dataset.id, pids)
+    return JsonResponse({
+        'state': AsyncResult(r.task_id).state,
+        'task_id': r.task_id,
+        'status_url': request.build_absolute_uri(reverse('sync_bins_status', kwargs={'task_id': r.task_id})),
+    })
+
+def sync_bins_status(request, task_id):
+    result = AsyncResult(task_id)
+    info = result.info
+    if isinstance(info, Exception):
+        info = str(info)
+    return JsonResponse({
+        'state': result.state,
+        'info': info,
+    })
+
 def about_page(request):
     return render(request, 'dashboard/about.html')
 
@@ -1377,10 +1663,17 @@ def legacy_single_roi_features(request, dataset_name, bin_id, target):
     })
 
 def extent(request):
-    bin_qs = filter_parameters_bin_query(request.GET).order_by("timestamp")
+    response = cached_response('extent', filter_parameters(request.GET), lambda: extent_data(request.GET))
+    if response is None:
+        raise Http404("no bins match the given query")
+
+    return JsonResponse(response)
+
+def extent_data(method):
+    bin_qs = filter_parameters_bin_query(method).order_by("timestamp")
 
     if bin_qs.count() == 0:
-        raise Http404("no bins match the given query")
+        return None
 
     first_bin = bin_qs.first()
     last_bin = bin_qs.last()
@@ -1420,7 +1713,7 @@ def extent(request):
     if last_bin.location is not None:
         response["end"]["location"] = [last_bin.latitude, last_bin.longitude]
 
-    return JsonResponse(response)
+    return response
 
 # Despite the name, there is no actual team page. If the team has a default dataset, the user will get
 #   redirected to its timeline page. If not, the user gets sent to the datasets page with this team
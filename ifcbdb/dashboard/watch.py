@@ -0,0 +1,118 @@
+import os
+import time
+import logging
+
+from inotify_simple import INotify, flags
+
+from .scan import is_fileset, child_directories
+
+FILESET_EXTENSIONS = ['.adc', '.hdr', '.roi']
+
+# events that indicate a file is complete
+FILE_DONE = flags.CLOSE_WRITE | flags.MOVED_TO
+# events that indicate a new subdirectory
+DIR_CREATED = flags.CREATE | flags.MOVED_TO
+
+WATCH_MASK = FILE_DONE | DIR_CREATED
+
+logger = logging.getLogger(__name__)
+
+class FilesetWatcher(object):
+    """watches directory trees with inotify and reports filesets once all three of their files have been
+    written and closed, and no further writes have happened for the debounce period.
+
+    roots is a list of (path, key, whitelist, blacklist) tuples. the key (e.g., a DataDirectory) is reported
+    alongside each fileset found under that path, and the whitelist and blacklist select the subdirectories
+    of that path to watch, as for ifcb.DataDirectory.
+
+    if the kernel's event queue overflows, events have been lost, so every root is scanned again and any
+    complete filesets in it are reported."""
+    def __init__(self, roots, debounce=2):
+        self.inotify = INotify()
+        self.roots = roots
+        self.debounce = debounce
+        self.watches = {} # watch descriptor -> (directory path, root)
+        self.pending = {} # fileset path without extension -> (set of completed extensions, key)
+        self.last_event = {} # fileset path without extension -> time of last event
+        self.rescan()
+    def rescan(self):
+        for root in self.roots:
+            self.watch_tree(root[0], root)
+    def watch_tree(self, path, root):
+        # add a watch for a directory and all of its subdirectories. filesets that are already complete
+        # when the watch is added (e.g., in a directory that was moved into place) are reported too
+        _, key, whitelist, blacklist = root
+        try:
+            wd = self.inotify.add_watch(path, WATCH_MASK)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        self.watches[wd] = (path, root)
+        subdirs, filenames = [], set()
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    subdirs.append(entry.name)
+                else:
+                    filenames.add(entry.name)
+        for filename in filenames:
+            basename, ext = os.path.splitext(filename)
+            if ext == '.adc' and is_fileset(filenames, basename):
+                self.file_done(os.path.join(path, basename), FILESET_EXTENSIONS, key)
+        for child in child_directories(subdirs, whitelist, blacklist):
+            self.watch_tree(os.path.join(path, child), root)
+    def watched(self, dirpath, name, whitelist, blacklist):
+        # whether a new subdirectory is watched can depend on its siblings, if any are whitelisted
+        try:
+            names = [entry.name for entry in os.scandir(dirpath) if entry.is_dir()]
+        except FileNotFoundError:
+            return False
+        return name in child_directories(names, whitelist, blacklist)
+    def file_done(self, basepath, extensions, key):
+        done, _ = self.pending.get(basepath, (set(), key))
+        done.update(extensions)
+        self.pending[basepath] = (done, key)
+        self.last_event[basepath] = time.time()
+    def read(self, timeout=1000):
+        # process inotify events, waiting up to timeout ms for them
+        overflowed = False
+        for event in self.inotify.read(timeout=timeout):
+            if event.mask & flags.Q_OVERFLOW: # the kernel dropped events
+                overflowed = True
+                continue
+            if event.wd not in self.watches:
+                continue
+            dirpath, root = self.watches[event.wd]
+            _, key, whitelist, blacklist = root
+            if event.mask & flags.IGNORED: # directory was removed
+                del self.watches[event.wd]
+                continue
+            path = os.path.join(dirpath, event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & DIR_CREATED and self.watched(dirpath, event.name, whitelist, blacklist):
+                    self.watch_tree(path, root)
+                continue
+            if event.mask & FILE_DONE:
+                basepath, ext = os.path.splitext(path)
+                if ext in FILESET_EXTENSIONS:
+                    self.file_done(basepath, [ext], key)
+        if overflowed:
+            logger.warning('inotify event queue overflowed, rescanning watched directories')
+            self.rescan()
+    def ready(self):
+        # return (fileset path without extension, key) for completed filesets that have settled
+        now = time.time()
+        result = []
+        for basepath, (done, key) in list(self.pending.items()):
+            if len(done) < len(FILESET_EXTENSIONS):
+                continue
+            if now - self.last_event[basepath] < self.debounce:
+                continue
+            del self.pending[basepath]
+            del self.last_event[basepath]
+            dirpath, basename = os.path.split(basepath)
+            if not is_fileset(set(os.listdir(dirpath)), basename):
+                continue # not a valid bin id, or the files were removed
+            result.append((basepath, key))
+        return sorted(result)
+    def close(self):
+        self.inotify.close()
@@ -169,6 +169,23 @@ CSRF_TRUSTED_ORIGINS = [https_origin, http_origin]
 
 DEFAULT_DATASET = os.getenv('DEFAULT_DATASET', '')
 
+# number of worker processes used by dataset syncs started from the web interface
+ACCESSION_WORKERS = int(os.getenv('ACCESSION_WORKERS', '1'))
+
+# directory shared by the web and celery containers where uploaded files are kept until they're processed
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', '/uploads')
+
+# directory shared by the web and celery containers where columnar exports are written, and how long they're kept
+EXPORT_DIR = os.getenv('EXPORT_DIR', '/exports')
+EXPORT_CACHE_TIMEOUT = int(os.getenv('EXPORT_CACHE_TIMEOUT', str(24 * 60 * 60)))
+
+# on-disk cache of rendered mosaic pages and its size in bytes. when MOSAIC_CACHE_X_ACCEL is set, cached pages
+# are served by nginx from the internal location MOSAIC_CACHE_URL, which must be an alias of MOSAIC_CACHE_DIR
+MOSAIC_CACHE_DIR = os.getenv('MOSAIC_CACHE_DIR', '/mosaics')
+MOSAIC_CACHE_SIZE = int(os.getenv('MOSAIC_CACHE_SIZE', str(2 * 1024 ** 3)))
+MOSAIC_CACHE_URL = os.getenv('MOSAIC_CACHE_URL', '/mosaic-cache/')
+MOSAIC_CACHE_X_ACCEL = os.getenv('MOSAIC_CACHE_X_ACCEL', 'false').lower() == 'true'
+
 try:
     from .local_settings import *
 except ImportError as e:
@@ -1,7 +1,9 @@
 import json
-from io import BytesIO
+import os
+import tempfile
 from itertools import groupby
 from operator import attrgetter
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User, Group
 from django.db.models import Count
@@ -18,7 +20,9 @@ from dashboard.models import Dataset, Instrument, DataDirectory, Tag, TagEvent,
 from .forms import DatasetForm, InstrumentForm, DirectoryForm, MetadataUploadForm, AppSettingsForm, TagForm, \
     MergeTagForm, UserForm, TeamForm, BinSearchForm, BinActionForm
 
-from dashboard.accession import export_metadata
+from dashboard.accession import export_metadata_csv
+from dashboard.rollups import update_rollups, update_bin_rollups
+from dashboard.datacache import bump_catalog_version
 from common import auth
 from common.constants import Features, TeamRoles, BinManagementActions, BIN_ID_COLUMNS
 
@@ -409,6 +413,8 @@ def merge_tag(request, id):
             if TagEvent.objects.filter(tag=tag).count() == 0:
                 tag.delete()
 
+            bump_catalog_version()
+
             return redirect(reverse("secure:tag-management"))
     else:
         form = MergeTagForm(instance=tag)
@@ -768,6 +774,7 @@ def sync_dataset(request, dataset_id):
     from dashboard.tasks import sync_dataset
     # params
     newest_only = request.POST.get('newest_only') == 'true'
+    incremental = request.POST.get('incremental') == 'true'
     # ensure that the dataset exists
     ds = get_object_or_404(Dataset, id=dataset_id)
     # attempt to lock the dataset
@@ -777,7 +784,7 @@ def sync_dataset(request, dataset_id):
         return JsonResponse({ 'state': 'LOCKED' })
     # start the task asynchronously
     cancel_key = dataset_sync_cancel_key(dataset_id)
-    r = sync_dataset.delay(dataset_id, lock_key, cancel_key, newest_only=newest_only)
+    r = sync_dataset.delay(dataset_id, lock_key, cancel_key, newest_only=newest_only, incremental=incremental)
     # cache the task id so we can look it up by dataset id
     cache.set(dataset_sync_task_id_key(dataset_id), r.task_id, timeout=None)
     result = AsyncResult(r.task_id)
@@ -816,6 +823,18 @@ METADATA_UPLOAD_LOCK_KEY = 'metadata_upload_lock'
 METADATA_UPLOAD_CANCEL_KEY = 'metadata_upload_cancel'
 METADATA_UPLOAD_TASKID_KEY = 'metadata_upload_task_id'
 
+# number of rows of an uploaded metadata file to check at a time
+METADATA_UPLOAD_CHUNK_SIZE = 10000
+
+def spool_upload(file, prefix):
+    # copy an uploaded file to the upload area shared with the celery workers, and return its path
+    os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix='.csv', dir=settings.UPLOAD_DIR)
+    with os.fdopen(fd, 'wb') as fout:
+        for chunk in file.chunks():
+            fout.write(chunk)
+    return path
+
 @login_required
 def upload_metadata(request):
     if not auth.can_manage_metadata(request.user):
@@ -830,11 +849,17 @@ def upload_metadata(request):
         form = MetadataUploadForm(request.POST, request.FILES)
         if form.is_valid():
             file = request.FILES['file']
+            path = spool_upload(file, 'metadata-')
 
             try:
-                df = pd.read_csv(file)
-                json_df = df.to_json()
+                # check the syntax of the whole file without holding all of it in memory
+                with pd.read_csv(path, chunksize=METADATA_UPLOAD_CHUNK_SIZE) as chunks:
+                    columns = None
+                    for chunk in chunks:
+                        if columns is None:
+                            columns = chunk.columns
             except:
+                os.remove(path)
                 form.add_error(None, "CSV syntax error")
                 return render(request, 'secure/upload-metadata.html', {
                     'form': form,
@@ -843,16 +868,18 @@ def upload_metadata(request):
                     })
 
             # Filter down the list of bins to update to just ones the user has access to if they are not a super admin.
+            team_ids = None
             if not request.user.is_superuser:
-                def get_column(df, possible_names):
+                def get_column(columns, possible_names):
                     for possible in possible_names:
-                        if possible in df.columns:
+                        if possible in columns:
                             return possible
                     return None
 
                 # Make sure there's a bin column
-                pid_col = get_column(df, BIN_ID_COLUMNS)
+                pid_col = get_column(columns if columns is not None else [], BIN_ID_COLUMNS)
                 if pid_col is None:
+                    os.remove(path)
                     form.add_error(None, "need to specify bin ID column")
                     return render(request, 'secure/upload-metadata.html', {
                         'form': form,
@@ -861,22 +888,14 @@ def upload_metadata(request):
                     })
 
                 team_ids = list(TeamUser.objects.filter(user=request.user).values_list('team_id', flat=True))
-                pids_to_check = list(df[pid_col])
-                bins_ids = Bin.objects \
-                    .filter(pid__in=pids_to_check) \
-                    .filter(team_id__in=team_ids) \
-                    .values_list("pid", flat=True)
-                bins_ids = list(bins_ids)
-
-                df = df[df[pid_col].isin(bins_ids)]
-                json_df = df.to_json()
 
             added = cache.add(METADATA_UPLOAD_LOCK_KEY, True, timeout=None) # this is atomic
             if added:
-                r = import_metadata.delay(json_df, METADATA_UPLOAD_LOCK_KEY, METADATA_UPLOAD_CANCEL_KEY)
+                r = import_metadata.delay(path, METADATA_UPLOAD_LOCK_KEY, METADATA_UPLOAD_CANCEL_KEY, team_ids=team_ids)
                 cache.set(METADATA_UPLOAD_TASKID_KEY, r.task_id, timeout=None)
                 return redirect(reverse("secure:upload-metadata") + "?confirm=true")
             else:
+                os.remove(path)
                 form.add_error(None, "Upload already in progress, please wait")
                 in_progress = 'true'
 
@@ -928,6 +947,7 @@ def toggle_skip(request):
     bin = get_object_or_404(Bin, pid=bin_id)
     bin.skip = not skipped
     bin.save()
+    update_bin_rollups([bin.id], [bin.sample_time])
 
     return JsonResponse({
         "bin_id": bin_id,
@@ -1030,14 +1050,9 @@ def bin_management_export(request, dataset_name=None):
         })
 
     bin_qs = build_bin_query_from_form_data(request.user, form)
-    df = export_metadata(None, bin_qs)
     filename = 'bins.csv'
 
-    csv_buf = BytesIO()
-    df.to_csv(csv_buf, mode='wb', index=None)
-    csv_buf.seek(0)
-
-    response = StreamingHttpResponse(csv_buf, content_type='text/csv')
+    response = StreamingHttpResponse(export_metadata_csv(None, bin_qs), content_type='text/csv')
     response['Content-Disposition'] = f'attachment; filename={filename}'
 
     return response
@@ -1109,13 +1124,18 @@ def build_bin_query_from_form_data(user, form):
 
 def update_skip(bin_qs, is_skipped):
     total = 0
+    bin_ids, times = [], []
 
     for bin in bin_qs:
         bin.skip = is_skipped
         bin.save()
 
+        bin_ids.append(bin.id)
+        times.append(bin.sample_time)
         total += 1
 
+    update_bin_rollups(bin_ids, times)
+
     return JsonResponse({
         "success": True,
         "message": f"{total} bin(s) have been updated successfully",
@@ -1126,6 +1146,7 @@ def assign_dataset(bin_qs, dataset):
     num_already_assigned = dataset.bins.filter(id__in=bin_qs.values_list("id", flat=True)).count()
 
     dataset.bins.add(*bin_qs)
+    update_rollups([dataset.id], bin_qs.values_list('sample_time', flat=True))
 
     total = bin_qs.count()
     num_assigned = total - num_already_assigned
@@ -1154,7 +1175,10 @@ def unassign_dataset(bin_qs, dataset):
             "message": f"No bins were unassigned because there weren't any assigned to dataset {dataset}",
         })
 
+    # read the sample times first, since bin_qs may be filtered on the dataset the bins are leaving
+    sample_times = list(bin_qs.values_list('sample_time', flat=True))
     dataset.bins.remove(*bin_qs)
+    update_rollups([dataset.id], sample_times)
 
     label = "bins" if num_assigned != 1 else "bin"
     return JsonResponse({
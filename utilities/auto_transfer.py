@@ -32,6 +32,7 @@ def sync_ifcb(name, dashboard_url, ifcb_config):
     if dataset is None:
         raise ValueError('dataset must be specified')
     day_dirs = ifcb_config.get('day_dirs',False)
+    sync_batch_size = int(ifcb_config.get('sync_batch_size',100))
 
     def destination(lid):
         if day_dirs:
@@ -41,13 +42,27 @@ def sync_ifcb(name, dashboard_url, ifcb_config):
 
         return dest
 
-    def hit_sync_endpoint(lid):
-        url = f'{dashboard_url}/api/sync_bin?dataset={dataset}&bin={lid}'
+    # transferred bins waiting to be synced, sent to the dashboard in batches
+    pending = []
+
+    def hit_sync_endpoint():
+        if not pending:
+            return
+        url = f'{dashboard_url}/api/sync_bins'
+        lids = list(pending)
+        pending.clear()
         try:
-            logging.info(f'hitting {url} ...')
-            requests.get(url)
+            logging.info(f'hitting {url} with {len(lids)} bin(s) ...')
+            r = requests.post(url, data={'dataset': dataset, 'bins': ','.join(lids)})
+            r.raise_for_status()
+            logging.info(f'sync queued, status at {r.json()["status_url"]}')
         except:
-            logging.error(f'unable to reach {url}, {lid} not synced!')
+            logging.error(f'unable to reach {url}, {", ".join(lids)} not synced!')
+
+    def fileset_transferred(lid):
+        pending.append(lid)
+        if len(pending) >= sync_batch_size:
+            hit_sync_endpoint()
 
     logging.info(f'connecting to {name} ...')
 
@@ -56,11 +71,13 @@ def sync_ifcb(name, dashboard_url, ifcb_config):
             share=share, directory=directory, timeout=timeout)
 
         with ifcb:
-            ifcb.sync(destination, fileset_callback=hit_sync_endpoint)
+            ifcb.sync(destination, fileset_callback=fileset_transferred)
             logging.info(f'completed transferring from {name}')
     except:
         logging.error(f'unable to transfer from {name}')
         traceback.print_exc()
+    finally:
+        hit_sync_endpoint()
 
     if beads_destination_directory is not None:
         logging.info(f'transferring beads ...')